@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import numpy
+import knn
+from quantize import Quantizer
+
+
+class QueryCache:
+    """LRU cache of kNN results in front of an engine or a KNNModel.
+
+    Entries are keyed on the query vector and k (plus the vote weights for
+    predict). The vector is first normalized when the source can do that
+    (KNNModel.normalize) and, with quantized=True, snapped to the 8-bit
+    grid of quantize.Quantizer. Near-identical queries then share an entry
+    and get the result of whichever of them was looked up first.
+
+    Only misses reach the source, as one batch. If the source has a version
+    attribute (KNNModel does), a changed version clears the cache before
+    the next lookup. Immutable engines never go stale; call invalidate()
+    after replacing one by hand.
+
+    cache.neighbors([x], k)[0] is the cached form of getNeighbors(engine, x, k).
+    """
+
+    def __init__(self, source, maxSize: int = 4096, quantized: bool = False):
+        self.source = source
+        self.dims = source.dims
+        self.maxSize = maxSize
+        self.quantizer = Quantizer('uint8') if quantized else None
+        self._entries = OrderedDict()
+        self._version = getattr(source, 'version', None)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        """Drop every entry, e.g. after the training set changed"""
+        self._entries.clear()
+        self.invalidations += 1
+
+    def _keys(self, matrix):
+        normalize = getattr(self.source, 'normalize', None)
+        if normalize is not None:
+            matrix = normalize(matrix)
+        if self.quantizer is not None:
+            matrix = self.quantizer.encode(matrix)
+        return [row.tobytes() for row in numpy.ascontiguousarray(matrix)]
+
+    def _lookup(self, kind, queries, compute):
+        """Cached value per query row; compute(matrix) fills the misses in one call"""
+        version = getattr(self.source, 'version', None)
+        if version != self._version:
+            self._version = version
+            self.invalidate()
+        matrix = knn.asMatrix(queries, self.dims)
+        keys = [(kind, key) for key in self._keys(matrix)]
+        entries = self._entries
+        results = [None] * len(keys)
+        # first row of each missing key, so a repeated query is computed once
+        missing = {}
+        for i, key in enumerate(keys):
+            value = entries.get(key)
+            if value is None:
+                missing.setdefault(key, i)
+            else:
+                entries.move_to_end(key)
+                results[i] = value
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            rows = list(missing.values())
+            for key, value in zip(missing, compute(matrix[rows])):
+                entries[key] = value
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = entries[key]
+            overflow = len(entries) - self.maxSize
+            for _ in range(max(0, overflow)):
+                entries.popitem(last=False)
+            self.evictions += max(0, overflow)
+        return results
+
+    def kneighbors(self, queries, k: int):
+        """Same result as source.kneighbors(queries, k), from the cache where possible"""
+        def compute(matrix):
+            indices, dists = self.source.kneighbors(matrix, k)
+            return list(zip(indices, dists))
+
+        results = self._lookup(('kneighbors', k), queries, compute)
+        if not results:
+            return numpy.empty((0, k), dtype=numpy.intp), numpy.empty((0, k))
+        return numpy.array([r[0] for r in results]), numpy.array([r[1] for r in results])
+
+    def neighbors(self, queries, k: int):
+        """Training rows of kneighbors(), for sources with a rows attribute (DistanceEngine)"""
+        indices, _ = self.kneighbors(queries, k)
+        return [[self.source.rows[i] for i in row] for row in indices]
+
+    def predict(self, queries, k: int, weights: str = 'uniform'):
+        def compute(matrix):
+            if weights == 'uniform':
+                return self.source.predict(matrix, k)
+            return self.source.predict(matrix, k, weights)
+
+        return self._lookup(('predict', k, weights), queries, compute)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxSize': self.maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hitRate': self.hits / float(lookups) if lookups else 0.0,
+        }
+
+
+def main():
+    import random
+    import time
+    from model import KNNModel
+
+    random.seed(0)
+    trainingSet, testSet = knn.nloadDataSet("iris.data", 0.67, seed=0)
+    cache = QueryCache(knn.DistanceEngine(trainingSet), maxSize=1024)
+    for label in ('cold', 'warm'):
+        start = time.perf_counter()
+        for row in testSet:
+            neighbors = cache.neighbors([row], 3)[0]
+        elapsed = time.perf_counter() - start
+        print('%s: %.1f us per getNeighbors lookup' % (label, elapsed / len(testSet) * 1e6))
+    assert neighbors == knn.getNeighbors(knn.DistanceEngine(trainingSet), testSet[-1], 3)
+    print(cache.stats())
+
+    model = KNNModel.fromCsv("iris.data")
+    cache = QueryCache(model, quantized=True)
+    samples = [[5.1, 3.5, 1.4, 0.2], [5.1, 3.5, 1.4, 0.2001], [6.7, 3.0, 5.2, 2.3]]
+    print(cache.predict(samples, 3))
+    model.add([6.0, 2.9, 4.5, 1.5, 'Iris-versicolor'])
+    print(cache.predict(samples, 3))
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main()
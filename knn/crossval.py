@@ -0,0 +1,93 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy
+import knn
+
+
+def folds(count: int, numFolds: int, seed: int = 0):
+    """Seeded k-fold split: a list of numFolds test index arrays covering every row once"""
+    order = numpy.random.default_rng(seed).permutation(count)
+    return numpy.array_split(order, numFolds)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not len(samples):
+        return {'p%d' % p: None for p in points}
+    values = numpy.percentile(samples, points)
+    return {'p%d' % p: float(v) for p, v in zip(points, values)}
+
+
+def crossValidate(dataset, numFolds: int = 5, kValues=range(1, 16), seed: int = 0, latencySamples: int = 200):
+    """Accuracy for every k and timing figures over a seeded k-fold split.
+
+    dataset is a knn.IrisTable (see knn.loadTable) or a list of
+    [f1, ..., fn, label] rows. Each fold builds one distance matrix and one
+    sorted neighbour matrix of width max(kValues); every k is scored from
+    prefixes of that matrix.
+    """
+    kValues = list(kValues)
+    maxK = max(kValues)
+    if isinstance(dataset, knn.IrisTable):
+        features, codes, classes = dataset.matrix(), dataset.labelCodes(), numpy.asarray(dataset.types)
+    else:
+        features = numpy.array([row[:-1] for row in dataset], dtype=numpy.float64)
+        classes, codes = numpy.unique([row[-1] for row in dataset], return_inverse=True)
+    correct = dict.fromkeys(kValues, 0)
+    scored = 0
+    batchTime = 0.0
+    latencies = []
+    for testIndices in folds(len(dataset), numFolds, seed):
+        testMask = numpy.zeros(len(dataset), dtype=bool)
+        testMask[testIndices] = True
+        trainIndices = numpy.flatnonzero(~testMask)
+        engine = knn.DistanceEngine.fromArrays(features[trainIndices], codes[trainIndices], classes)
+        queries = features[testIndices]
+        start = time.perf_counter()
+        neighbors, _ = engine.kneighbors(queries, maxK)
+        batchTime += time.perf_counter() - start
+        neighborCodes = codes[trainIndices][neighbors]
+        truth = codes[testIndices]
+        for k in kValues:
+            correct[k] += int((knn.vote(neighborCodes[:, :k], len(classes)) == truth).sum())
+        scored += len(testIndices)
+        # single-query latency as an online caller would see it
+        for i in range(min(len(queries), max(0, latencySamples // numFolds))):
+            start = time.perf_counter()
+            engine.predict(queries[i:i + 1], kValues[0])
+            latencies.append(time.perf_counter() - start)
+    return {
+        'rows': len(dataset),
+        'folds': numFolds,
+        'seed': seed,
+        'accuracy': {str(k): correct[k] / float(scored) * 100.0 for k in kValues},
+        'bestK': max(kValues, key=lambda k: (correct[k], -k)),
+        'latencySeconds': percentiles(latencies),
+        'throughputQps': scored / batchTime if batchTime else None,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seeded k-fold cross-validation and k sweep for knn')
+    parser.add_argument('path', nargs='?', default='iris.data')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--kmin', type=int, default=1)
+    parser.add_argument('--kmax', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the JSON result here instead of stdout')
+    args = parser.parse_args(argv)
+    result = crossValidate(knn.loadTable(args.path), args.folds, range(args.kmin, args.kmax + 1), args.seed)
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
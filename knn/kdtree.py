@@ -0,0 +1,240 @@
+import heapq
+import math
+import time
+import numpy
+
+
+class _Node:
+    __slots__ = ('axis', 'split', 'left', 'right', 'indices', 'size')
+
+    def __init__(self, indices=None):
+        self.axis = -1
+        self.split = 0.0
+        self.left = None
+        self.right = None
+        self.indices = indices
+        # rows in the subtree, kept up to date by insert for rebalancing
+        self.size = len(indices) if indices is not None else 0
+
+    def isLeaf(self):
+        return self.indices is not None
+
+
+class KDTree:
+    """KD-tree over normalized rows, built once and reused for every query.
+
+    Rows are the lists returned by normalizeData (features first, label
+    last). Queries give exactly the same neighbours, in the same order, as
+    the brute-force getNeighbors: ordered by distance, ties broken by the
+    position of the row in the training set.
+
+    insert() keeps the tree balanced scapegoat-style: when a row lands
+    deeper than about 2*log2(rows), the lowest lopsided subtree on its path
+    is rebuilt, so ordered (e.g. time-ordered) inserts do not degrade it
+    into a list.
+    """
+
+    # a subtree whose bigger child holds more than this share of its rows is lopsided
+    BALANCE = 0.7
+
+    def __init__(self, trainingSet, dims: int = 4, leafSize: int = 16):
+        start = time.perf_counter()
+        self.dims = dims
+        self.leafSize = leafSize
+        self.rows = list(trainingSet)
+        self._count = len(self.rows)
+        self._points = numpy.empty((max(16, self._count), dims))
+        if self._count:
+            self._points[:self._count] = [row[:dims] for row in self.rows]
+        self.root = self._build(numpy.arange(self._count))
+        self.buildTime = time.perf_counter() - start
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def points(self):
+        return self._points[:self._count]
+
+    def _build(self, indices):
+        if len(indices) <= self.leafSize:
+            return _Node(list(indices))
+        pts = self._points[indices]
+        axis = int(numpy.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        mid = len(indices) // 2
+        order = numpy.argpartition(pts[:, axis], mid)
+        node = _Node()
+        node.size = len(indices)
+        node.axis = axis
+        node.split = float(pts[order[mid], axis])
+        node.left = self._build(indices[order[:mid]])
+        node.right = self._build(indices[order[mid:]])
+        return node
+
+    def _splitLeaf(self, node):
+        indices = numpy.array(node.indices)
+        pts = self._points[indices]
+        spread = pts.max(axis=0) - pts.min(axis=0)
+        if not spread.any():
+            return  # all points identical, nothing to split on
+        built = self._build(indices)
+        self._replace(node, built)
+
+    @staticmethod
+    def _replace(node, built):
+        # in place, so the parent keeps pointing at node
+        node.axis, node.split, node.size = built.axis, built.split, built.size
+        node.left, node.right, node.indices = built.left, built.right, built.indices
+
+    def _rebuild(self, node):
+        """Rebuild the subtree under node as a balanced one"""
+        indices = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.isLeaf():
+                indices.extend(current.indices)
+            else:
+                stack.append(current.left)
+                stack.append(current.right)
+        self._replace(node, self._build(numpy.array(sorted(indices), dtype=numpy.intp)))
+
+    def insert(self, row):
+        """Add one row to the index without rebuilding it"""
+        if self._count == len(self._points):
+            grown = numpy.empty((2 * len(self._points), self.dims))
+            grown[:self._count] = self._points[:self._count]
+            self._points = grown
+        index = self._count
+        self._points[index] = row[:self.dims]
+        self.rows.append(row)
+        self._count += 1
+        node = self.root
+        path = []
+        while not node.isLeaf():
+            node.size += 1
+            path.append(node)
+            node = node.left if row[node.axis] < node.split else node.right
+        node.indices.append(index)
+        node.size += 1
+        if len(node.indices) > 2 * self.leafSize:
+            self._splitLeaf(node)
+        if len(path) > 2 * math.log2(max(2, self._count)):
+            for parent in reversed(path):
+                if max(parent.left.size, parent.right.size) > self.BALANCE * parent.size:
+                    self._rebuild(parent)
+                    break
+        return index
+
+    def depth(self):
+        """Number of splits on the longest root-to-leaf path"""
+        deepest = 0
+        stack = [(self.root, 0)]
+        while stack:
+            node, level = stack.pop()
+            if node.isLeaf():
+                deepest = max(deepest, level)
+            else:
+                stack.append((node.left, level + 1))
+                stack.append((node.right, level + 1))
+        return deepest
+
+    def _leafDistances(self, node, query):
+        diff = self._points[node.indices] - query
+        return numpy.sqrt((diff * diff).sum(axis=1))
+
+    def query(self, testInstance, k: int):
+        """Indices and distances of the k nearest rows, nearest first"""
+        query = numpy.array(testInstance[:self.dims], dtype=numpy.float64)
+        k = min(k, self._count)
+        if k <= 0:
+            return [], []
+        # max-heap of the best k as (-distance, -index)
+        best = []
+        # (node, distance from the query to the node's side of the splits above it)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, gap = stack.pop()
+            # a small slack keeps rounding in the sqrt from pruning a tie
+            if len(best) == k and gap > -best[0][0] * (1 + 1e-12):
+                continue
+            if node.isLeaf():
+                if node.indices:
+                    for i, d in zip(node.indices, self._leafDistances(node, query).tolist()):
+                        if len(best) < k:
+                            heapq.heappush(best, (-d, -i))
+                        elif (d, i) < (-best[0][0], -best[0][1]):
+                            heapq.heapreplace(best, (-d, -i))
+                continue
+            diff = query[node.axis] - node.split
+            near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+            # far is pushed first so the near side is searched, and best tightened, before it
+            stack.append((far, abs(diff)))
+            stack.append((near, 0.0))
+
+        found = sorted((-d, -i) for d, i in best)
+        return [i for _, i in found], [d for d, _ in found]
+
+    def neighbors(self, testInstance, k: int):
+        """Same result as getNeighbors(trainingSet, testInstance, k)"""
+        indices, _ = self.query(testInstance, k)
+        return [self.rows[i] for i in indices]
+
+    def radius(self, testInstance, r: float):
+        """Indices and distances of every row within r, nearest first"""
+        query = numpy.array(testInstance[:self.dims], dtype=numpy.float64)
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.isLeaf():
+                if node.indices:
+                    for i, d in zip(node.indices, self._leafDistances(node, query).tolist()):
+                        if d <= r:
+                            found.append((d, i))
+                continue
+            diff = query[node.axis] - node.split
+            near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+            stack.append(near)
+            if abs(diff) <= r * (1 + 1e-12):
+                stack.append(far)
+        found.sort()
+        return [i for _, i in found], [d for d, _ in found]
+
+
+def main(seed: int = 0):
+    """Check the tree against brute force; exits with status 1 on any mismatch"""
+    import random
+    import sys
+    import knn
+
+    # seeded, so a reported mismatch can be replayed
+    rng = random.Random(seed)
+    dataset = knn.normalizeData("iris.data")
+    tree = KDTree(dataset)
+    print('Build time: %.6fs for %d rows' % (tree.buildTime, len(tree)))
+    mismatches = 0
+    for row in dataset:
+        k = rng.randint(1, len(dataset))
+        if tree.neighbors(row, k) != knn.getNeighbors(dataset, row, k):
+            mismatches += 1
+        r = rng.random() * 0.3
+        expected = [i for i in range(len(dataset))
+                    if knn.euclideanDistance(row, dataset[i], 4) <= r]
+        if sorted(tree.radius(row, r)[0]) != expected:
+            mismatches += 1
+    # same checks after growing a tree one insert at a time
+    grown = KDTree(dataset[:10], leafSize=4)
+    for row in dataset[10:]:
+        grown.insert(row)
+    for row in dataset:
+        k = rng.randint(1, len(dataset))
+        if grown.neighbors(row, k) != knn.getNeighbors(dataset, row, k):
+            mismatches += 1
+    print('Mismatches against brute force (seed %d): %d' % (seed, mismatches))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
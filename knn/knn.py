@@ -1,17 +1,17 @@
+import argparse
 import math
 import csv
 import random
 import operator
+import sys
 import numpy
 import copy
+from array import array
+import profiling
 
 
 class Iris:
-    _sepal_lenght = None
-    _sepal_width = None
-    _petal_lenght = None
-    _petal_width = None
-    _flower_type = None
+    __slots__ = ('_sepal_lenght', '_sepal_width', '_petal_lenght', '_petal_width', '_flower_type')
 
     def __init__(self, sl: float, sw: float, pl: float, pw: float, type: str):
         self._sepal_lenght = sl
@@ -37,47 +37,174 @@ class Iris:
 
 
 def IrisDistance(a: Iris, b: Iris) -> float:
-    k = a.sl() - b.sl()
-    l = a.sw() - b.sw()
-    m = a.pl() - b.pl()
-    n = a.pw() - b.pw()
+    k = a._sepal_lenght - b._sepal_lenght
+    l = a._sepal_width - b._sepal_width
+    m = a._petal_lenght - b._petal_lenght
+    n = a._petal_width - b._petal_width
     sum = k * k + l * l + m * m + n * n
     return math.sqrt(sum)
 
+
+class IrisTable:
+    """Struct-of-arrays Iris records: one array('d') per feature, interned labels.
+
+    A record costs 4 doubles plus one int label code, instead of an object
+    with a dict or a list of boxed floats. The columns are exposed to NumPy
+    without copying for the bulk distance in IrisDistances.
+    """
+
+    COLUMNS = ('sl', 'sw', 'pl', 'pw')
+
+    def __init__(self):
+        self.sl = array('d')
+        self.sw = array('d')
+        self.pl = array('d')
+        self.pw = array('d')
+        self.codes = array('i')
+        self.types = []
+        self._typeCodes = {}
+
+    @classmethod
+    def fromRows(cls, rows):
+        """Table from [sl, sw, pl, pw, type] rows such as normalizeData returns"""
+        table = cls()
+        for row in rows:
+            table.append(*row[:5])
+        return table
+
+    @classmethod
+    def fromChunks(cls, chunks):
+        """Table from (features, labels) chunks such as iterNormalized yields"""
+        table = cls()
+        for features, labels in chunks:
+            for column, name in enumerate(cls.COLUMNS):
+                getattr(table, name).extend(features[:, column].tolist())
+            table.codes.extend(table._intern(label) for label in labels.tolist())
+        return table
+
+    def _intern(self, type: str) -> int:
+        code = self._typeCodes.get(type)
+        if code is None:
+            code = self._typeCodes[type] = len(self.types)
+            self.types.append(type)
+        return code
+
+    def append(self, sl: float, sw: float, pl: float, pw: float, type: str) -> int:
+        self.sl.append(sl)
+        self.sw.append(sw)
+        self.pl.append(pl)
+        self.pw.append(pw)
+        self.codes.append(self._intern(type))
+        return len(self.codes) - 1
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i) -> Iris:
+        return Iris(self.sl[i], self.sw[i], self.pl[i], self.pw[i], self.types[self.codes[i]])
+
+    def column(self, name: str):
+        """Zero-copy NumPy view of one column.
+
+        The view pins the column's buffer: while any view is alive, append()
+        raises BufferError. Copy the view, or drop it, before appending.
+        """
+        column = getattr(self, name)
+        return numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == 'd' else numpy.intc)
+
+    def matrix(self):
+        """(records x 4) float64 copy of the features, e.g. for DistanceEngine.fromArrays"""
+        return numpy.column_stack([self.column(name) for name in self.COLUMNS])
+
+    def labelCodes(self):
+        """Copy of the label-code column as an int array indexing types"""
+        return self.column('codes').astype(numpy.intp)
+
+    def engine(self, **kwargs):
+        """DistanceEngine over a copy of the table, leaving the table appendable"""
+        return DistanceEngine.fromArrays(self.matrix(), self.labelCodes(), numpy.asarray(self.types), **kwargs)
+
+
+def IrisDistances(table: IrisTable, b: Iris):
+    """IrisDistance from b to every record of table at once, as a NumPy array"""
+    k = table.column('sl') - b._sepal_lenght
+    l = table.column('sw') - b._sepal_width
+    m = table.column('pl') - b._petal_lenght
+    n = table.column('pw') - b._petal_width
+    sum = k * k + l * l + m * m + n * n
+    return numpy.sqrt(sum)
+
+
+def readChunks(path: str, chunkSize: int = 65536, dims: int = 4):
+    """Yield (features, labels) NumPy chunks of at most chunkSize rows.
+
+    Blank lines, including the trailing ones iris.data ends with, are
+    skipped, so only one chunk of the file is ever held in memory.
+    Producing each chunk is recorded as the parseCsv stage.
+    """
+    return profiling.timedIter('parseCsv', _readChunks(path, chunkSize, dims))
+
+
+def _readChunks(path, chunkSize, dims):
+    with open(path, 'r', newline='') as file:
+        rows = []
+        for row in csv.reader(file):
+            if not row or not ''.join(row).strip():
+                continue
+            rows.append(row)
+            if len(rows) == chunkSize:
+                yield _toChunk(rows, dims)
+                rows = []
+        if rows:
+            yield _toChunk(rows, dims)
+
+
+def _toChunk(rows, dims):
+    features = numpy.array([row[:dims] for row in rows], dtype=numpy.float64)
+    labels = numpy.array([row[dims].strip() if len(row) > dims else '' for row in rows])
+    return features, labels
+
+
+def columnRange(path: str, chunkSize: int = 65536, dims: int = 4):
+    """Per-column min and max of the whole file in one chunked pass"""
+    min = numpy.full(dims, numpy.inf)
+    max = numpy.full(dims, -numpy.inf)
+    for features, _ in readChunks(path, chunkSize, dims):
+        numpy.minimum(min, features.min(axis=0), out=min)
+        numpy.maximum(max, features.max(axis=0), out=max)
+    return min, max
+
+
+def iterNormalized(path: str, chunkSize: int = 65536, dims: int = 4, bounds=None):
+    """Yield (features, labels) chunks scaled to [0, 1] per column.
+
+    bounds is the (min, max) pair from columnRange; when left out the file
+    is read twice, once for the bounds and once to normalize.
+    """
+    min, max = bounds if bounds is not None else columnRange(path, chunkSize, dims)
+    span = max - min
+    span[span == 0] = 1.0
+    for features, labels in readChunks(path, chunkSize, dims):
+        with profiling.timed('normalize'):
+            features -= min
+            features /= span
+        yield features, labels
+
+
+def loadTable(path: str, chunkSize: int = 65536) -> IrisTable:
+    """Whole dataset scaled to [0, 1] per column, in the compact IrisTable form"""
+    return IrisTable.fromChunks(iterNormalized(path, chunkSize))
+
+
+@profiling.stage()
 def normalizeData(path : str):
-    max = [0.0,0.0,0.0,0.0]
-    min = [999.0,999.0,999.0,999.0]
-    arrfunc = []
-    originalData = None
-#    normData = None
-    # Get smallest and biggest numbers
-    with open(path,'r') as file:
-        lines = csv.reader(file)
-        originalData = list(lines)
-        for x in range(len(originalData) - 1):
-            for y in range(4):
-                originalData[x][y] = float(originalData[x][y])
-                k = originalData[x][y]
-                if k > max[y]:
-                    max[y] = k
-                if k < min[y]:
-                    min[y] = k
-    # Create a list of functions to apply to its respective column
-    for y in range(4):
-        g = lambda x: (x - min[y])/(max[y] - min[y])
-        arrfunc.append(g)
-
-    #normData = copy.deepcopy(originalData)
-    # Normalize applying functions
-    for x in range(len(originalData) - 1):
-        for y in range(4):
-            originalData[x][y] = arrfunc[y](originalData[x][y])
-    #print("max values " + repr(max))
-    #print("min values " + repr(min))
-
-    #for x in range(len(originalData) - 1):
-    #    print(repr(originalData[x]) + " >>>> " + repr(normData[x]))
-    return originalData
+    """Whole dataset as [f1, f2, f3, f4, label] lists scaled to [0, 1] per column"""
+    dataset = []
+    for features, labels in iterNormalized(path):
+        for row, label in zip(features.tolist(), labels.tolist()):
+            row.append(label)
+            dataset.append(row)
+    return dataset
 
 
 def euclideanDistance(a, b, lenght):
@@ -87,21 +214,172 @@ def euclideanDistance(a, b, lenght):
         unsquaredDistance += (r * r)
     return math.sqrt(unsquaredDistance)
 
-def nloadDataSet(path: str, split: float):
+class RowView:
+    """Read-only list-like view giving [f1, ..., fn, label] rows over feature/label arrays"""
+
+    def __init__(self, features, labelCodes, classes):
+        self.features = features
+        self.labelCodes = labelCodes
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, i):
+        row = self.features[i].tolist()
+        row.append(self.classes[self.labelCodes[i]].item())
+        return row
+
+
+def asMatrix(rows, dims: int, dtype=numpy.float64):
+    """(n x dims) matrix of the first dims columns of rows.
+
+    rows may be an array, one row or a list of [f1, ..., fn, label] rows;
+    arrays are only copied when the dtype or layout requires it.
+    """
+    if isinstance(rows, numpy.ndarray):
+        return numpy.asarray(rows[..., :dims], dtype=dtype).reshape(-1, dims)
+    if len(rows) == 0:
+        return numpy.empty((0, dims), dtype=dtype)
+    return numpy.array([row[:dims] for row in rows], dtype=dtype).reshape(-1, dims)
+
+
+class DistanceEngine:
+    """Brute-force kNN over a training set held as one contiguous matrix.
+
+    Features are kept in a C-contiguous float64 matrix with the labels in a
+    separate array, so a whole batch of queries is answered with one matrix
+    product and an argpartition instead of a Python loop and a full sort.
+    """
+
+    def __init__(self, trainingSet, dims: int = 4, blockElements: int = 1 << 23):
+        self.rows = trainingSet
+        self.dims = dims
+        # upper bound on the size of one (queries x training rows) distance block
+        self.blockElements = blockElements
+        self.dtype = numpy.dtype(numpy.float64)
+        self.features = numpy.ascontiguousarray(self._asMatrix(trainingSet))
+        self.classes, self.labelCodes = numpy.unique([row[-1] for row in trainingSet], return_inverse=True)
+        self._sqNorms = None
+
+    @classmethod
+    def fromArrays(cls, features, labelCodes, classes, blockElements: int = 1 << 23, sqNorms=None):
+        """Engine over an existing (rows x dims) matrix, used as-is without a copy.
+
+        features may be a numpy.memmap; float32 matrices stay float32 and the
+        queries are converted to match instead. labelCodes index into classes;
+        sqNorms, the squared row norms, can be passed when already known.
+        """
+        engine = cls.__new__(cls)
+        engine.dims = features.shape[1]
+        engine.blockElements = blockElements
+        engine.dtype = features.dtype
+        engine.features = features
+        engine.labelCodes = labelCodes
+        engine.classes = numpy.asarray(classes)
+        engine.rows = RowView(features, labelCodes, engine.classes)
+        engine._sqNorms = sqNorms
+        return engine
+
+    def __len__(self):
+        return len(self.features)
+
+    @property
+    def labels(self):
+        return self.classes[self.labelCodes]
+
+    @property
+    def sqNorms(self):
+        # computed on first use so opening a large mapped set stays cheap
+        if self._sqNorms is None:
+            self._sqNorms = numpy.einsum('ij,ij->i', self.features, self.features)
+        return self._sqNorms
+
+    def _asMatrix(self, rows):
+        return asMatrix(rows, self.dims, self.dtype)
+
+    def squaredDistances(self, queries):
+        """(queries x training rows) squared distances via |q|^2 - 2q.x + |x|^2"""
+        queries = self._asMatrix(queries)
+        sq = numpy.einsum('ij,ij->i', queries, queries)[:, None] - 2.0 * (queries @ self.features.T)
+        sq += self.sqNorms
+        return numpy.maximum(sq, 0.0, out=sq)
+
+    def distances(self, queries):
+        return numpy.sqrt(self.squaredDistances(queries))
+
+    def kneighbors(self, queries, k: int):
+        """Indices and distances of the k nearest training rows for each query.
+
+        Rows come back ordered by distance, ties broken by training index,
+        which is the order the original stable sort in getNeighbors gives.
+        """
+        queries = self._asMatrix(queries)
+        k = min(k, len(self.features))
+        indices = numpy.empty((len(queries), k), dtype=numpy.intp)
+        dists = numpy.empty((len(queries), k))
+        if k == 0:
+            return indices, dists
+        batch = max(1, self.blockElements // max(1, len(self.features)))
+        maxNorm = self.sqNorms.max()
+        eps = numpy.finfo(self.dtype).eps
+        for start in range(0, len(queries), batch):
+            stop = start + batch
+            with profiling.timed('distances'):
+                block = self.squaredDistances(queries[start:stop])
+            with profiling.timed('neighbourSort'):
+                width = k
+                if k < block.shape[1]:
+                    part = numpy.argpartition(block, k - 1, axis=1)[:, :k]
+                    kth = numpy.take_along_axis(block, part, axis=1).max(axis=1)
+                    # the expanded form is only accurate to rounding, so anything
+                    # that close to the k-th distance is re-checked exactly below
+                    slack = 64 * eps * (1.0 + maxNorm + numpy.einsum('ij,ij->i', queries[start:stop], queries[start:stop]))
+                    width = int((block <= (kth + slack)[:, None]).sum(axis=1).max())
+                if width >= block.shape[1]:
+                    part = numpy.tile(numpy.arange(block.shape[1]), (len(block), 1))
+                elif width > k:
+                    part = numpy.argpartition(block, width - 1, axis=1)[:, :width]
+                diff = queries[start:stop, None, :] - self.features[part]
+                exact = numpy.sqrt((diff * diff).sum(axis=2))
+                order = numpy.lexsort((part, exact), axis=1)[:, :k]
+                indices[start:stop] = numpy.take_along_axis(part, order, axis=1)
+                dists[start:stop] = numpy.take_along_axis(exact, order, axis=1)
+        return indices, dists
+
+    def neighbors(self, queries, k: int):
+        """Same as kneighbors but returning the training rows themselves"""
+        indices, _ = self.kneighbors(queries, k)
+        return [[self.rows[i] for i in row] for row in indices]
+
+    def predict(self, queries, k: int, weights: str = 'uniform'):
+        """Voted label of the k nearest rows for each query, see vote()"""
+        indices, dists = self.kneighbors(queries, k)
+        with profiling.timed('vote'):
+            codes = vote(self.labelCodes[indices], len(self.classes), dists, weights)
+        return self.classes[codes].tolist()
+
+
+@profiling.stage()
+def nloadDataSet(path: str, split: float, seed=None):
+    """Random train/test split, each row landing in exactly one of the two sets"""
+    rng = random.Random(seed) if seed is not None else random
     trainDataset = []
     testDataset = []
     dataset =  normalizeData(path)
-    for x in range(len(dataset) - 1):
-        for y in range(4):
-            if random.random() < split:
-                trainDataset.append(dataset[x])
-            else:
-                testDataset.append(dataset[x])
+    for x in range(len(dataset)):
+        if rng.random() < split:
+            trainDataset.append(dataset[x])
+        else:
+            testDataset.append(dataset[x])
     return trainDataset, testDataset
 
 
 
+@profiling.stage()
 def getNeighbors(trainingSet, testInstance, k):
+    if isinstance(trainingSet, DistanceEngine):
+        return trainingSet.neighbors([testInstance], k)[0]
     distances = []
     length = len(testInstance) - 1
     for x in range(len(trainingSet)):
@@ -113,6 +391,7 @@ def getNeighbors(trainingSet, testInstance, k):
         neighbors.append(distances[x][0])
     return neighbors
 
+@profiling.stage()
 def getResponse(neighbors):
     classVotes = {}
     for x in range(len(neighbors)):
@@ -124,29 +403,74 @@ def getResponse(neighbors):
     sortedVotes = sorted(classVotes.items(), key=operator.itemgetter(1), reverse=True)
     return sortedVotes[0][0]
 
+def vote(neighborCodes, numClasses: int, distances=None, weights: str = 'uniform'):
+    """Winning class code per row of a (queries x k) neighbour label-code matrix.
+
+    weights is 'uniform' (one vote each, as getResponse counts) or
+    'distance' (each vote weighs 1/distance; exact matches, if a query has
+    any, take all the weight). Ties go to the tied class whose first
+    neighbour is nearest, which is also what getResponse returns.
+    """
+    neighborCodes = numpy.asarray(neighborCodes)
+    n, k = neighborCodes.shape
+    if n == 0 or k == 0:
+        return numpy.zeros(n, dtype=numpy.intp)
+    if weights == 'uniform':
+        w = None
+    elif weights == 'distance':
+        distances = numpy.asarray(distances, dtype=numpy.float64)
+        exact = distances == 0
+        with numpy.errstate(divide='ignore'):
+            w = numpy.where(exact.any(axis=1)[:, None], exact, 1.0 / distances)
+        w = w.ravel()
+    else:
+        raise ValueError("weights must be 'uniform' or 'distance', not %r" % (weights,))
+    flat = (numpy.arange(n)[:, None] * numClasses + neighborCodes).ravel()
+    scores = numpy.bincount(flat, weights=w, minlength=n * numClasses).reshape(n, numClasses)
+    rows = numpy.arange(n)
+    best = scores.max(axis=1)
+    # first neighbour position whose class reaches the top score
+    reaches = scores[rows[:, None], neighborCodes] == best[:, None]
+    return neighborCodes[rows, reaches.argmax(axis=1)]
+
+@profiling.stage()
 def getAccuracy(testDataset, predictions):
     correct = 0
     for x in range(len(testDataset)):
-        if testDataset[x][-1] is predictions[x]:
+        if testDataset[x][-1] == predictions[x]:
             correct += 1
     return (correct / float(len(testDataset))) * 100.0
 
 
-def main():
-    trainingDataset = []
-    testSet = []
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='kNN classification of the iris dataset')
+    parser.add_argument('path', nargs='?', default='iris.data')
+    parser.add_argument('--profile', nargs='?', const='table', choices=('table', 'json'),
+                        help='time each pipeline stage and print a table (default) or JSON to stderr')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiling.enable()
+    # imported here because trainset imports this module
+    import trainset
+
     split = 0.67
-    path = "iris.data"  # put dataset path here
-    trainingDataset, testSet = nloadDataSet(path, split)
-    predictions = []
+    path = args.path
+    # the normalized binary form is parsed once and memory-mapped on later runs
+    with profiling.timed('loadTrainingSet'):
+        dataset = trainset.cachedTrainingSet(path)
+    train = numpy.random.random_sample(len(dataset)) < split
+    classes = numpy.asarray(dataset.labels)
+    engine = DistanceEngine.fromArrays(dataset.features[train], dataset.labelCodes[train], classes)
+    testSet = RowView(dataset.features[~train], dataset.labelCodes[~train], classes)
     k = 3
+    predictions = engine.predict(dataset.features[~train], k)
     for x in range(len(testSet)):
-        neighbors = getNeighbors(trainingDataset, testSet[x], k)
-        result = getResponse(neighbors)
-        predictions.append(result)
+        result = predictions[x]
         print('Predito: ' + repr(result) + ' >Atual: ' + repr(testSet[x][-1]))
     accuracy = getAccuracy(testSet, predictions)
     print('Acerto: ' + repr(accuracy) + '%')
+    if args.profile:
+        sys.stderr.write(profiling.dump(args.profile) + '\n')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+import time
+import numpy
+import knn
+
+
+class LSHIndex:
+    """Approximate kNN with random-projection (p-stable) locality-sensitive hashing.
+
+    Each of the numTables tables hashes a row to floor((a.x + b) / bucketWidth)
+    over numHashes random projections. A query only looks at the rows that
+    share a bucket with it in at least one table and ranks those exactly.
+
+    The knobs trade recall for latency: more tables or wider buckets find
+    more true neighbours, more hashes per table or a smaller maxCandidates
+    make each query cheaper. The API mirrors DistanceEngine so the two can
+    be swapped and compared with evaluate().
+    """
+
+    def __init__(self, trainingSet, dims: int = 4, numTables: int = 8, numHashes: int = 4,
+                 bucketWidth: float = 0.25, maxCandidates: int = None, seed: int = 0):
+        self.rows = trainingSet
+        self.dims = dims
+        self.numTables = numTables
+        self.numHashes = numHashes
+        self.bucketWidth = bucketWidth
+        self.maxCandidates = maxCandidates
+        rng = numpy.random.default_rng(seed)
+        self._projections = rng.standard_normal((dims, numTables * numHashes))
+        self._offsets = rng.uniform(0.0, bucketWidth, numTables * numHashes)
+        # odd multipliers folding one table's bucket coordinates into one key
+        self._mix = rng.integers(1, 1 << 62, numHashes, dtype=numpy.int64) | 1
+        if isinstance(trainingSet, numpy.ndarray):
+            self.features = numpy.ascontiguousarray(trainingSet[:, :dims], dtype=numpy.float64)
+        else:
+            self.features = numpy.array([row[:dims] for row in trainingSet], dtype=numpy.float64).reshape(-1, dims)
+        keys = self._keys(self.features)
+        self._order = numpy.argsort(keys, axis=0, kind='stable').T
+        self._sortedKeys = numpy.take_along_axis(keys, self._order.T, axis=0).T
+
+    def __len__(self):
+        return len(self.features)
+
+    def _keys(self, points):
+        buckets = numpy.floor((points @ self._projections + self._offsets) / self.bucketWidth)
+        buckets = buckets.astype(numpy.int64).reshape(len(points), self.numTables, self.numHashes)
+        with numpy.errstate(over='ignore'):
+            return (buckets * self._mix).sum(axis=2)
+
+    def candidates(self, keys):
+        """Training indices sharing a bucket with the query in any table"""
+        found = []
+        for t in range(self.numTables):
+            lo = numpy.searchsorted(self._sortedKeys[t], keys[t], side='left')
+            hi = numpy.searchsorted(self._sortedKeys[t], keys[t], side='right')
+            found.append(self._order[t, lo:hi])
+        found, collisions = numpy.unique(numpy.concatenate(found), return_counts=True)
+        if self.maxCandidates is not None and len(found) > self.maxCandidates:
+            # rows colliding in more tables are more likely to be close
+            keep = numpy.argpartition(-collisions, self.maxCandidates - 1)[:self.maxCandidates]
+            found = numpy.sort(found[keep])
+        return found
+
+    def kneighbors(self, queries, k: int):
+        """Approximate indices and distances, padded with -1 / inf when short"""
+        queries = knn.asMatrix(queries, self.dims)
+        keys = self._keys(queries)
+        indices = numpy.full((len(queries), k), -1, dtype=numpy.intp)
+        dists = numpy.full((len(queries), k), numpy.inf)
+        for q in range(len(queries)):
+            found = self.candidates(keys[q])
+            if len(found) == 0:
+                continue
+            diff = self.features[found] - queries[q]
+            exact = numpy.sqrt((diff * diff).sum(axis=1))
+            order = numpy.lexsort((found, exact))[:k]
+            indices[q, :len(order)] = found[order]
+            dists[q, :len(order)] = exact[order]
+        return indices, dists
+
+    def neighbors(self, queries, k: int):
+        indices, _ = self.kneighbors(queries, k)
+        return [[self.rows[i] for i in row if i >= 0] for row in indices]
+
+
+def evaluate(index, engine, queries, k: int):
+    """recall@k and queries per second of an approximate index against the exact engine"""
+    start = time.perf_counter()
+    exact, _ = engine.kneighbors(queries, k)
+    exactTime = time.perf_counter() - start
+    start = time.perf_counter()
+    approx, _ = index.kneighbors(queries, k)
+    approxTime = time.perf_counter() - start
+    hits = 0
+    for a, e in zip(approx, exact):
+        hits += len(numpy.intersect1d(a[a >= 0], e))
+    n = len(exact)
+    return {
+        'k': k,
+        'queries': n,
+        'recall': hits / float(max(1, exact.size)),
+        'approxQps': n / approxTime if approxTime else float('inf'),
+        'exactQps': n / exactTime if exactTime else float('inf'),
+    }
+
+
+def sweep(trainingSet, queries, k: int, engine, grid):
+    """Run evaluate() for every parameter dict in grid, e.g. {'numTables': 4, 'bucketWidth': 0.1}"""
+    results = []
+    for params in grid:
+        index = LSHIndex(trainingSet, **params)
+        result = evaluate(index, engine, queries, k)
+        result.update(params)
+        results.append(result)
+    return results
+
+
+def main():
+    import random
+
+    random.seed(0)
+    trainingSet, testSet = knn.nloadDataSet("iris.data", 0.67)
+    engine = knn.DistanceEngine(trainingSet)
+    grid = [{'numTables': t, 'numHashes': h, 'bucketWidth': w}
+            for t in (2, 8) for h in (2, 4) for w in (0.1, 0.3)]
+    print('tables hashes width  recall@3  approx q/s  exact q/s')
+    for r in sweep(trainingSet, testSet, 3, engine, grid):
+        print('%6d %6d %5.2f  %8.3f  %10.0f  %9.0f' % (
+            r['numTables'], r['numHashes'], r['bucketWidth'], r['recall'], r['approxQps'], r['exactQps']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import numpy
+import knn
+
+
+class KNNModel:
+    """kNN model that takes labelled samples one at a time.
+
+    Samples are [f1, ..., fn, label] rows of raw (unnormalized) features.
+    The model keeps the features divided by the current column span. The
+    column minimum cancels out of every difference, so only the span matters
+    for distances. A new extreme only widens the span and marks the stored
+    matrix stale. The matrix is rescaled once, on the next query, by the
+    ratio of old to new span, so add() and remove() are O(1) amortized.
+
+    Removing a sample never narrows min/max; renormalize() recomputes them
+    from the live samples when that matters.
+    """
+
+    def __init__(self, dims: int = 4, k: int = 3, capacity: int = 1024):
+        self.dims = dims
+        self.k = k
+        self.min = numpy.full(dims, numpy.inf)
+        self.max = numpy.full(dims, -numpy.inf)
+        self._scaled = numpy.empty((capacity, dims))
+        self._sqNorms = numpy.empty(capacity)
+        self._codes = numpy.empty(capacity, dtype=numpy.intp)
+        self._ids = numpy.empty(capacity, dtype=numpy.int64)
+        self._slots = {}
+        self._count = 0
+        self._nextId = 0
+        # span the stored rows are currently divided by, and the live one
+        self._storedSpan = numpy.ones(dims)
+        self._span = numpy.ones(dims)
+        self.classes = []
+        self._classCodes = {}
+        self._engine = None
+        # bumped on every change, lets callers invalidate derived results
+        self.version = 0
+
+    @classmethod
+    def fromCsv(cls, path: str, dims: int = 4, k: int = 3, chunkSize: int = 65536):
+        model = cls(dims, k)
+        for features, labels in knn.readChunks(path, chunkSize, dims):
+            model.addMany(features, labels.tolist())
+        return model
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, id):
+        return id in self._slots
+
+    def _grow(self, needed: int):
+        capacity = len(self._scaled)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('_scaled', '_sqNorms', '_codes', '_ids'):
+            old = getattr(self, name)
+            new = numpy.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+
+    def _code(self, label) -> int:
+        code = self._classCodes.get(label)
+        if code is None:
+            code = self._classCodes[label] = len(self.classes)
+            self.classes.append(label)
+        return code
+
+    def _changed(self):
+        self.version += 1
+        self._engine = None
+
+    def add(self, sample) -> int:
+        """Add one labelled sample, returning the id to remove() it with"""
+        return self.addMany([sample[:self.dims]], [sample[-1]])[0]
+
+    def addMany(self, features, labels):
+        features = numpy.asarray(features, dtype=numpy.float64).reshape(-1, self.dims)
+        if len(features) == 0:
+            return []
+        numpy.minimum(self.min, features.min(axis=0), out=self.min)
+        numpy.maximum(self.max, features.max(axis=0), out=self.max)
+        span = self.max - self.min
+        span[span == 0] = 1.0
+        self._span = span
+        start, stop = self._count, self._count + len(features)
+        self._grow(stop)
+        # stored in the scale of the rows already there, see _rescale
+        scaled = features / self._storedSpan
+        self._scaled[start:stop] = scaled
+        self._sqNorms[start:stop] = numpy.einsum('ij,ij->i', scaled, scaled)
+        self._codes[start:stop] = [self._code(label) for label in labels]
+        ids = list(range(self._nextId, self._nextId + len(features)))
+        self._ids[start:stop] = ids
+        for slot, id in enumerate(ids, start):
+            self._slots[id] = slot
+        self._nextId += len(features)
+        self._count = stop
+        self._changed()
+        return ids
+
+    def remove(self, id: int):
+        """Drop a sample by id; the last row moves into its slot"""
+        slot = self._slots.pop(id)
+        last = self._count - 1
+        if slot != last:
+            for array in (self._scaled, self._sqNorms, self._codes, self._ids):
+                array[slot] = array[last]
+            self._slots[int(self._ids[slot])] = slot
+        self._count = last
+        self._changed()
+
+    def renormalize(self):
+        """Recompute min/max from the live samples, e.g. after removing extremes"""
+        if not self._count:
+            self.min[:] = numpy.inf
+            self.max[:] = -numpy.inf
+            self._changed()
+            return
+        self._rescale()
+        raw = self._scaled[:self._count] * self._storedSpan
+        self.min = raw.min(axis=0)
+        self.max = raw.max(axis=0)
+        span = self.max - self.min
+        span[span == 0] = 1.0
+        self._span = span
+        self._changed()
+
+    def _rescale(self):
+        if numpy.array_equal(self._span, self._storedSpan):
+            return
+        rows = self._scaled[:self._count]
+        rows *= self._storedSpan / self._span
+        self._sqNorms[:self._count] = numpy.einsum('ij,ij->i', rows, rows)
+        self._storedSpan = self._span.copy()
+
+    def normalize(self, features):
+        """Raw features scaled to [0, 1] with the current column bounds"""
+        features = numpy.asarray(features, dtype=numpy.float64)[..., :self.dims]
+        return (features - self.min) / self._span
+
+    def engine(self) -> knn.DistanceEngine:
+        """DistanceEngine over the live rows, cached until the model changes"""
+        self._rescale()
+        if self._engine is None:
+            self._engine = knn.DistanceEngine.fromArrays(
+                self._scaled[:self._count], self._codes[:self._count], self.classes,
+                sqNorms=self._sqNorms[:self._count])
+        return self._engine
+
+    def _queries(self, samples):
+        if not isinstance(samples, numpy.ndarray):
+            samples = numpy.array([row[:self.dims] for row in samples], dtype=numpy.float64)
+        samples = samples[..., :self.dims]
+        self._rescale()
+        return samples.reshape(-1, self.dims) / self._storedSpan
+
+    def kneighbors(self, samples, k: int = None):
+        """Ids and normalized distances of the k nearest samples to each raw query"""
+        engine = self.engine()
+        slots, dists = engine.kneighbors(self._queries(samples), k or self.k)
+        return self._ids[slots], dists
+
+    def predict(self, samples, k: int = None):
+        engine = self.engine()
+        return engine.predict(self._queries(samples), k or self.k)
+
+
+def main():
+    import random
+
+    random.seed(0)
+    dataset = []
+    with open("iris.data") as file:
+        for line in file:
+            if line.strip():
+                row = line.strip().split(',')
+                dataset.append([float(x) for x in row[:4]] + [row[4]])
+    random.shuffle(dataset)
+    model = KNNModel()
+    ids = [model.add(row) for row in dataset[:100]]
+    for id in ids[:10]:
+        model.remove(id)
+    predictions = model.predict(dataset[100:])
+    print('Accuracy after online updates: ' + repr(knn.getAccuracy(dataset[100:], predictions)) + '%')
+
+
+if __name__ == '__main__':
+    main()
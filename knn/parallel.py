@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy
+import knn
+
+# set in every worker by _attach, shared by all the chunks it classifies
+_engine = None
+_blocks = []
+
+
+def _share(array):
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    view = numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _view(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    _blocks.append(block)  # keep the mapping alive as long as the worker
+    return numpy.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _attach(featureSpec, codeSpec, classes, blockElements):
+    global _engine
+    _engine = knn.DistanceEngine.fromArrays(_view(featureSpec), _view(codeSpec), classes, blockElements)
+
+
+def _classifyChunk(start, queries, k):
+    return start, _engine.predict(queries, k)
+
+
+def classify(trainingSet, testRows, k: int, workers: int = None, chunkSize: int = 1024):
+    """Predicted label for every test row, in the order of testRows.
+
+    Queries are split into chunks and spread over a pool of worker
+    processes. The training matrix is copied once into shared memory and
+    every worker maps it, so nothing but the query chunks and the labels
+    going back is pickled. trainingSet may be a list of rows or a
+    DistanceEngine (for instance one opened from a binary training set).
+    """
+    engine = trainingSet if isinstance(trainingSet, knn.DistanceEngine) else knn.DistanceEngine(trainingSet)
+    queries = engine._asMatrix(testRows)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(queries) <= chunkSize:
+        return engine.predict(queries, k)
+
+    featureBlock, featureSpec = _share(numpy.ascontiguousarray(engine.features))
+    codeBlock, codeSpec = _share(numpy.ascontiguousarray(engine.labelCodes))
+    predictions = [None] * len(queries)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(featureSpec, codeSpec, engine.classes.tolist(),
+                                           engine.blockElements)) as pool:
+            futures = [pool.submit(_classifyChunk, start, queries[start:start + chunkSize], k)
+                       for start in range(0, len(queries), chunkSize)]
+            for future in futures:
+                start, labels = future.result()
+                predictions[start:start + len(labels)] = labels
+    finally:
+        for block in (featureBlock, codeBlock):
+            block.close()
+            block.unlink()
+    return predictions
+
+
+def main():
+    import time
+
+    trainingSet = knn.normalizeData("iris.data")
+    rng = numpy.random.default_rng(0)
+    # the iris rows with a little noise, repeated up to a batch-scoring size
+    base = numpy.array([row[:4] for row in trainingSet])
+    queries = base[rng.integers(0, len(base), 200000)] + rng.normal(0, 0.02, (200000, 4))
+    engine = knn.DistanceEngine(trainingSet)
+    for workers in (1, 2, 4):
+        start = time.perf_counter()
+        predictions = classify(engine, queries, 3, workers=workers, chunkSize=4096)
+        elapsed = time.perf_counter() - start
+        print('%d worker(s): %.0f queries/s' % (workers, len(predictions) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import functools
+import json
+import math
+import time
+from contextlib import nullcontext
+
+# Off by default. Instrumented code then pays one global lookup per call.
+enabled = False
+_stats = {}
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        # power-of-two latency buckets in microseconds: exponent -> count
+        self.buckets = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        # anything under a microsecond goes into the <=1us bucket
+        exponent = max(0, math.frexp(seconds * 1e6)[1]) if seconds > 0 else 0
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    _stats.clear()
+
+
+def record(name: str, seconds: float):
+    stage = _stats.get(name)
+    if stage is None:
+        stage = _stats[name] = _Stage()
+    stage.add(seconds)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timed(name: str):
+    """with timed('stage'): ... records the block's duration while profiling is enabled"""
+    return _Timer(name) if enabled else _NULL
+
+
+def timedIter(name: str, iterable):
+    """Yield from iterable, recording the time spent producing each item as name.
+
+    Only the producer is timed, not the work the caller does between items.
+    """
+    if not enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record(name, time.perf_counter() - start)
+        yield item
+
+
+def stage(name: str = None):
+    """Decorator recording every call of the function under name (default: its name)"""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def report() -> dict:
+    """Per stage: calls, total/mean/min/max seconds and a latency histogram.
+
+    Histogram keys are upper bounds in microseconds ('<=64us'). Stages nest,
+    so an outer stage's time includes the stages called inside it.
+    """
+    result = {}
+    for name, stage in _stats.items():
+        result[name] = {
+            'count': stage.count,
+            'totalSeconds': stage.total,
+            'meanSeconds': stage.total / stage.count,
+            'minSeconds': stage.min,
+            'maxSeconds': stage.max,
+            'histogram': {'<=%dus' % (1 << exponent): stage.buckets[exponent]
+                          for exponent in sorted(stage.buckets)},
+        }
+    return result
+
+
+def formatTable(result: dict) -> str:
+    lines = ['%-24s %8s %12s %12s %12s' % ('stage', 'calls', 'total ms', 'mean us', 'max us')]
+    for name, s in sorted(result.items(), key=lambda item: -item[1]['totalSeconds']):
+        lines.append('%-24s %8d %12.3f %12.1f %12.1f' % (
+            name, s['count'], s['totalSeconds'] * 1e3, s['meanSeconds'] * 1e6, s['maxSeconds'] * 1e6))
+        lines.append('%-24s %s' % ('', ' '.join('%s:%d' % item for item in s['histogram'].items())))
+    return '\n'.join(lines)
+
+
+def dump(format: str = 'table') -> str:
+    """The current report as a table or as JSON"""
+    if format == 'json':
+        return json.dumps(report(), indent=2)
+    return formatTable(report())
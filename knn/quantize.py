@@ -0,0 +1,183 @@
+import sys
+import time
+import numpy
+import knn
+
+PRECISIONS = ('float64', 'float32', 'uint8', 'int8')
+
+
+class Quantizer:
+    """Maps values in [low, high] linearly onto the 256 codes of uint8 or int8.
+
+    One scale is shared by every column, so the squared distance between two
+    code vectors is the true squared distance divided by scale**2, up to
+    rounding. Normalized data already lies in [0, 1], which is the default
+    range; values outside it are clipped.
+    """
+
+    def __init__(self, precision: str = 'uint8', low: float = 0.0, high: float = 1.0):
+        if precision not in ('uint8', 'int8'):
+            raise ValueError('quantized precision must be uint8 or int8, not %r' % precision)
+        self.dtype = numpy.dtype(precision)
+        self.low = float(low)
+        self.scale = (float(high) - self.low) / 255.0 or 1.0
+        # int8 codes are the uint8 codes shifted down by 128
+        self.shift = 0 if precision == 'uint8' else 128
+
+    def encode(self, values):
+        codes = numpy.rint((numpy.asarray(values, dtype=numpy.float64) - self.low) / self.scale)
+        return (numpy.clip(codes, 0, 255) - self.shift).astype(self.dtype)
+
+    def decode(self, codes):
+        return (numpy.asarray(codes, dtype=numpy.float64) + self.shift) * self.scale + self.low
+
+
+class QuantizedEngine:
+    """Brute-force kNN whose training matrix is stored as 8-bit codes.
+
+    The codes are kept column by column (dims x rows), so the kernel streams
+    one byte per value and accumulates exact integer squared distances in
+    code units. A distance then costs an eighth of the float64 memory
+    traffic, and ties in code space are broken by training index. With
+    rerank > 0 and fullFeatures given, the rerank nearest rows by code are
+    ranked again with full-precision distances. fullFeatures may be a memmap
+    (e.g. TrainingSet.features), which then only reads the candidate rows.
+    """
+
+    def __init__(self, features, labelCodes, classes, precision: str = 'uint8', rerank: int = 0,
+                 fullFeatures=None, blockElements: int = 1 << 23, low: float = 0.0, high: float = 1.0):
+        features = numpy.asarray(features)
+        self.dims = features.shape[1]
+        self.precision = precision
+        self.quantizer = Quantizer(precision, low, high)
+        self.codes = numpy.ascontiguousarray(self.quantizer.encode(features).T)
+        self.labelCodes = numpy.asarray(labelCodes)
+        self.classes = numpy.asarray(classes)
+        self.rerank = rerank
+        self.fullFeatures = fullFeatures
+        self.blockElements = blockElements
+
+    def __len__(self):
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self):
+        """Resident feature bytes: the codes plus an in-memory re-ranking copy (a memmap is not counted)"""
+        full = self.fullFeatures
+        if self.rerank > 0 and isinstance(full, numpy.ndarray) and not isinstance(full, numpy.memmap):
+            return self.codes.nbytes + full.nbytes
+        return self.codes.nbytes
+
+    def codeDistances(self, queryCodes):
+        """(queries x training rows) squared distances in code units, as exact int32"""
+        count = self.codes.shape[1]
+        sq = numpy.zeros((len(queryCodes), count), dtype=numpy.int32)
+        for d in range(self.dims):
+            diff = self.codes[d] - queryCodes[:, d, None].astype(numpy.int32)
+            sq += diff * diff
+        return sq
+
+    def kneighbors(self, queries, k: int):
+        """Indices and distances of the k nearest rows, nearest first, ties by training index"""
+        queries = knn.asMatrix(queries, self.dims)
+        count = len(self)
+        k = min(k, count)
+        rerank = self.fullFeatures is not None and self.rerank > 0
+        width = min(count, max(k, self.rerank) if rerank else k)
+        indices = numpy.empty((len(queries), k), dtype=numpy.intp)
+        dists = numpy.empty((len(queries), k))
+        if k == 0:
+            return indices, dists
+        queryCodes = self.quantizer.encode(queries)
+        batch = max(1, self.blockElements // max(1, count))
+        for start in range(0, len(queries), batch):
+            stop = start + batch
+            # one unique int64 key per row: the code distance, then the index
+            keys = self.codeDistances(queryCodes[start:stop]).astype(numpy.int64) * count + numpy.arange(count)
+            if width < count:
+                keys = numpy.partition(keys, width - 1, axis=1)[:, :width]
+            keys.sort(axis=1)
+            part, sq = keys % count, keys // count
+            if rerank:
+                full = numpy.asarray(self.fullFeatures[part.ravel()], dtype=numpy.float64)
+                diff = queries[start:stop, None, :] - full.reshape(part.shape + (self.dims,))
+                exact = numpy.sqrt((diff * diff).sum(axis=2))
+                order = numpy.lexsort((part, exact), axis=1)[:, :k]
+                indices[start:stop] = numpy.take_along_axis(part, order, axis=1)
+                dists[start:stop] = numpy.take_along_axis(exact, order, axis=1)
+            else:
+                indices[start:stop] = part[:, :k]
+                dists[start:stop] = numpy.sqrt(sq[:, :k]) * self.quantizer.scale
+        return indices, dists
+
+    def predict(self, queries, k: int, weights: str = 'uniform'):
+        """Voted label of the k nearest rows for each query, see knn.vote()"""
+        indices, dists = self.kneighbors(queries, k)
+        codes = knn.vote(self.labelCodes[indices], len(self.classes), dists, weights)
+        return self.classes[codes].tolist()
+
+
+def storedEngine(trainingSet, precision: str = 'float64', rerank: int = 0):
+    """Engine over trainingSet with its features stored at the given precision.
+
+    float64 and float32 give a DistanceEngine; uint8 and int8 give a
+    QuantizedEngine, which keeps a float64 copy for re-ranking only when
+    rerank > 0.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision %r, expected one of %s' % (precision, ', '.join(PRECISIONS)))
+    features = numpy.array([row[:-1] for row in trainingSet], dtype=numpy.float64)
+    classes, labelCodes = numpy.unique([row[-1] for row in trainingSet], return_inverse=True)
+    if precision in ('float64', 'float32'):
+        return knn.DistanceEngine.fromArrays(features.astype(precision), labelCodes, classes)
+    return QuantizedEngine(features, labelCodes, classes, precision, rerank, features if rerank else None)
+
+
+def precisionReport(trainingSet, testSet, k: int = 3, configs=(('float64', 0), ('float32', 0), ('uint8', 0),
+                                                              ('int8', 0), ('uint8', 16))):
+    """Memory, accuracy and neighbour agreement of each (precision, rerank) against float64.
+
+    pythonBytes is what the same features cost as a list of Python floats.
+    """
+    values = len(trainingSet) * (len(trainingSet[0]) - 1) if trainingSet else 0
+    results = []
+    baseline = None
+    for precision, rerank in configs:
+        engine = storedEngine(trainingSet, precision, rerank)
+        start = time.perf_counter()
+        indices, _ = engine.kneighbors(testSet, k)
+        elapsed = time.perf_counter() - start
+        predictions = engine.predict(testSet, k)
+        result = {
+            'precision': precision,
+            'rerank': rerank,
+            'featureBytes': int(engine.nbytes if isinstance(engine, QuantizedEngine) else engine.features.nbytes),
+            'pythonBytes': values * (sys.getsizeof(1.0) + 8),
+            'accuracy': knn.getAccuracy(testSet, predictions),
+            'queriesPerSecond': len(testSet) / elapsed if elapsed else float('inf'),
+        }
+        if baseline is None:
+            baseline = dict(result, indices=indices, predictions=predictions)
+        result['compression'] = baseline['featureBytes'] / float(max(1, result['featureBytes']))
+        result['accuracyLoss'] = baseline['accuracy'] - result['accuracy']
+        result['agreement'] = sum(a == b for a, b in zip(predictions, baseline['predictions'])) / float(max(1, len(testSet)))
+        result['recall'] = sum(len(numpy.intersect1d(a, b)) for a, b in zip(indices, baseline['indices'])) / float(max(1, indices.size))
+        results.append(result)
+    return results
+
+
+def main():
+    import random
+
+    random.seed(0)
+    trainingSet, testSet = knn.nloadDataSet("iris.data", 0.67, seed=0)
+    print('precision rerank  bytes  x smaller  accuracy  loss   agree  recall@3')
+    for r in precisionReport(trainingSet, testSet, 3):
+        print('%9s %6d %6d %10.1f %9.2f %5.2f %7.3f %9.3f' % (
+            r['precision'], r['rerank'], r['featureBytes'], r['compression'], r['accuracy'],
+            r['accuracyLoss'], r['agreement'], r['recall']))
+    print('as Python floats: %d bytes' % r['pythonBytes'])
+
+
+if __name__ == '__main__':
+    main()
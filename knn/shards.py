@@ -0,0 +1,181 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy
+import knn
+import trainset
+
+MANIFEST = 'manifest.json'
+
+
+def writeShards(csvPath: str, outDir: str, shardSize: int = 1 << 20, chunkSize: int = 65536, dims: int = 4):
+    """Split a CSV dataset into shard files of shardSize rows under outDir.
+
+    Each shard is a regular training set file (see trainset.py), normalized
+    with the bounds of the whole dataset and sharing its label list, so any
+    one of them can also be opened on its own. At most one shard is held in
+    memory while writing.
+    """
+    _, low, high, labels = trainset.scanCsv(csvPath, chunkSize, dims)
+    encode = trainset.labelEncoder(labels)
+
+    os.makedirs(outDir, exist_ok=True)
+    shards = []
+    features = numpy.empty((shardSize, dims), dtype='<f4')
+    codes = numpy.empty(shardSize, dtype='<i4')
+    filled = 0
+    for chunk, chunkLabels in knn.iterNormalized(csvPath, chunkSize, dims, (low, high)):
+        chunkCodes = encode(chunkLabels)
+        start = 0
+        while start < len(chunk):
+            take = min(shardSize - filled, len(chunk) - start)
+            features[filled:filled + take] = chunk[start:start + take]
+            codes[filled:filled + take] = chunkCodes[start:start + take]
+            filled += take
+            start += take
+            if filled == shardSize:
+                shards.append(_writeShard(outDir, len(shards), features, codes, filled, low, high, labels))
+                filled = 0
+    if filled:
+        shards.append(_writeShard(outDir, len(shards), features, codes, filled, low, high, labels))
+
+    manifest = {'count': sum(shard['count'] for shard in shards), 'dims': dims, 'shardSize': shardSize,
+                'min': low.tolist(), 'max': high.tolist(), 'labels': list(labels), 'shards': shards}
+    with open(os.path.join(outDir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=1)
+    return manifest['count']
+
+
+def _writeShard(outDir, number, features, codes, count, low, high, labels):
+    name = 'shard-%05d.knn' % number
+    trainset.writeArrays(os.path.join(outDir, name), features[:count], codes[:count], low, high, list(labels))
+    return {'file': name, 'count': count}
+
+
+def _searchShard(path: str, offset: int, queries, k: int):
+    """Local top-k of one shard, with indices shifted to global row numbers"""
+    shard = trainset.openTrainingSet(path)
+    indices, dists = shard.engine().kneighbors(queries, k)
+    return indices + offset, dists, numpy.array(shard.labelCodes[indices])
+
+
+def mergeTopK(best, part, k: int):
+    """Keep the k nearest of two (indices, distances, codes) candidate sets per query.
+
+    Ties are broken by global row number, so the merged result is the one a
+    single engine over all shards would return.
+    """
+    indices, dists, codes = (numpy.concatenate(pair, axis=1) for pair in zip(best, part))
+    order = numpy.lexsort((indices, dists), axis=1)[:, :k]
+    return tuple(numpy.take_along_axis(array, order, axis=1) for array in (indices, dists, codes))
+
+
+class ShardedIndex:
+    """Exact kNN over a training set split into shard files by writeShards.
+
+    Shards are memory-mapped one at a time, searched for their local top-k
+    and folded into a running top-k per query. Resident data is therefore
+    one shard plus k candidates per query, however many rows there are.
+    With workers > 1 the shards are searched in a process pool and merged
+    as they finish.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as file:
+            manifest = json.load(file)
+        self.count = manifest['count']
+        self.dims = manifest['dims']
+        self.min = numpy.array(manifest['min'])
+        self.max = numpy.array(manifest['max'])
+        self.classes = numpy.asarray(manifest['labels'])
+        self.paths = [os.path.join(directory, shard['file']) for shard in manifest['shards']]
+        self.offsets = numpy.cumsum([0] + [shard['count'] for shard in manifest['shards']])
+
+    def __len__(self):
+        return self.count
+
+    def normalize(self, features):
+        """Scale raw query features with the training set's column bounds"""
+        return trainset.scaleFeatures(features, self.min, self.max)
+
+    def _partials(self, queries, k: int, workers: int):
+        jobs = list(zip(self.paths, self.offsets[:-1].tolist()))
+        if workers == 1 or len(jobs) == 1:
+            for path, offset in jobs:
+                yield _searchShard(path, offset, queries, k)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_searchShard, path, offset, queries, k) for path, offset in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def search(self, queries, k: int, workers: int = 1):
+        """Global indices, distances and label codes of the k nearest rows to each query.
+
+        workers=None uses one process per CPU.
+        """
+        queries = knn.asMatrix(queries, self.dims)
+        k = min(k, self.count)
+        best = (numpy.empty((len(queries), 0), dtype=numpy.intp), numpy.empty((len(queries), 0)),
+                numpy.empty((len(queries), 0), dtype='<i4'))
+        for part in self._partials(queries, k, workers or os.cpu_count() or 1):
+            best = mergeTopK(best, part, k)
+        return best
+
+    def kneighbors(self, queries, k: int, workers: int = 1):
+        """Same result as DistanceEngine.kneighbors over the unsharded set"""
+        indices, dists, _ = self.search(queries, k, workers)
+        return indices, dists
+
+    def rows(self, indices):
+        """Training rows [f1, ..., fn, label] for global row numbers, one shard mapped at a time"""
+        flat = numpy.asarray(indices).ravel()
+        shardOf = numpy.searchsorted(self.offsets, flat, side='right') - 1
+        rows = [None] * len(flat)
+        for number in numpy.unique(shardOf).tolist():
+            shard = trainset.openTrainingSet(self.paths[number])
+            for j in numpy.flatnonzero(shardOf == number).tolist():
+                local = int(flat[j] - self.offsets[number])
+                rows[j] = shard.features[local].tolist() + [self.classes[shard.labelCodes[local]].item()]
+        return rows
+
+    def neighbors(self, queries, k: int, workers: int = 1):
+        """Same as kneighbors but returning the training rows themselves"""
+        indices, _ = self.kneighbors(queries, k, workers)
+        rows = self.rows(indices)
+        width = indices.shape[1]
+        return [rows[i:i + width] for i in range(0, len(rows), width)] if width else [[] for _ in indices]
+
+    def predict(self, queries, k: int, weights: str = 'uniform', workers: int = 1):
+        """Voted label of the k nearest rows for each query, see knn.vote()"""
+        _, dists, codes = self.search(queries, k, workers)
+        return self.classes[knn.vote(codes, len(self.classes), dists, weights)].tolist()
+
+
+def main():
+    import shutil
+    import tempfile
+    import time
+
+    directory = tempfile.mkdtemp(prefix='knn-shards-')
+    try:
+        writeShards("iris.data", directory, shardSize=32)
+        index = ShardedIndex(directory)
+        whole = trainset.cachedTrainingSet("iris.data").engine()
+        queries = numpy.asarray(whole.features, dtype=numpy.float64)
+        expected = whole.kneighbors(queries, 5)
+        for workers in (1, 2):
+            start = time.perf_counter()
+            indices, dists = index.kneighbors(queries, 5, workers=workers)
+            elapsed = time.perf_counter() - start
+            mismatches = int((indices != expected[0]).any(axis=1).sum())
+            print('%d shard(s), %d worker(s): %d mismatches against one engine, %.4fs'
+                  % (len(index.paths), workers, mismatches, elapsed))
+        print('Nearest to first row: ' + repr(index.neighbors(queries[:1], 3)[0]))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import numpy
+import knn
+import profiling
+
+# File layout, all little-endian:
+#   magic "KNNT", uint32 version, uint32 header length, JSON header
+#   padding up to a 64 byte boundary
+#   float32 features, count x dims, row-major
+#   padding up to a 64 byte boundary
+#   int32 label codes, count (indices into the header's label list)
+MAGIC = b'KNNT'
+VERSION = 1
+ALIGN = 64
+_PREFIX = struct.Struct('<4sII')
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _header(count: int, dims: int, min, max, labels):
+    """Header dict and its encoded bytes, with the block offsets filled in"""
+    header = {'count': count, 'dims': dims, 'min': numpy.asarray(min).tolist(),
+              'max': numpy.asarray(max).tolist(), 'labels': labels, 'featureOffset': 0, 'labelOffset': 0}
+    # offsets depend on the header length, which depends on the offsets;
+    # reserving room for the widest possible numbers settles it in one go
+    reserved = len(json.dumps(dict(header, featureOffset=2 ** 63, labelOffset=2 ** 63)).encode('utf-8'))
+    header['featureOffset'] = _align(_PREFIX.size + reserved)
+    header['labelOffset'] = _align(header['featureOffset'] + count * dims * 4)
+    return header, json.dumps(header).encode('utf-8').ljust(reserved)
+
+
+class TrainingSet:
+    """Normalized training set opened from disk with numpy.memmap.
+
+    Opening only reads the header; features and labelCodes are mapped
+    read-only, so nothing is parsed or copied up front and every process
+    mapping the same file shares its pages in the OS page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, version, headerLength = _PREFIX.unpack(file.read(_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError('%s is not a kNN training set file' % path)
+            if version != VERSION:
+                raise ValueError('unsupported training set version %d in %s' % (version, path))
+            header = json.loads(file.read(headerLength).decode('utf-8'))
+        self.header = header
+        self.count = header['count']
+        self.dims = header['dims']
+        self.min = numpy.array(header['min'])
+        self.max = numpy.array(header['max'])
+        self.labels = header['labels']
+        if self.count:
+            self.features = numpy.memmap(path, dtype='<f4', mode='r', offset=header['featureOffset'],
+                                         shape=(self.count, self.dims))
+            self.labelCodes = numpy.memmap(path, dtype='<i4', mode='r', offset=header['labelOffset'],
+                                           shape=(self.count,))
+        else:
+            self.features = numpy.empty((0, self.dims), dtype='<f4')
+            self.labelCodes = numpy.empty(0, dtype='<i4')
+
+    def __len__(self):
+        return self.count
+
+    def normalize(self, features):
+        """Scale raw query features with the training set's column bounds"""
+        return scaleFeatures(features, self.min, self.max).astype(numpy.float32)
+
+    def engine(self, **kwargs):
+        """DistanceEngine working directly on the mapped feature block"""
+        return knn.DistanceEngine.fromArrays(self.features, self.labelCodes, self.labels, **kwargs)
+
+
+def scaleFeatures(features, min, max):
+    """Raw features scaled to [0, 1] with the given column bounds, as float64"""
+    span = max - min
+    span[span == 0] = 1.0
+    return (numpy.asarray(features, dtype=numpy.float64) - min) / span
+
+
+def scanCsv(csvPath: str, chunkSize: int = 65536, dims: int = 4):
+    """Row count, column min and max, and label -> code dict of a CSV in one chunked pass.
+
+    Codes follow first appearance in the file. An empty file gets zero bounds.
+    """
+    min = numpy.full(dims, numpy.inf)
+    max = numpy.full(dims, -numpy.inf)
+    count = 0
+    labels = {}
+    for features, chunkLabels in knn.readChunks(csvPath, chunkSize, dims):
+        with profiling.timed('scanBounds'):
+            numpy.minimum(min, features.min(axis=0), out=min)
+            numpy.maximum(max, features.max(axis=0), out=max)
+            count += len(features)
+            for label in numpy.unique(chunkLabels).tolist():
+                labels.setdefault(label, len(labels))
+    if not count:
+        min[:] = 0.0
+        max[:] = 0.0
+    return count, min, max, labels
+
+
+def labelEncoder(labels: dict):
+    """Function turning an array of labels into their int32 codes from the labels dict.
+
+    The lookup is one sorted search per array rather than a dict hit per row.
+    """
+    sortedLabels = numpy.array(sorted(labels))
+    sortedCodes = numpy.array([labels[label] for label in sorted(labels)], dtype='<i4')
+
+    def encode(chunkLabels):
+        return sortedCodes[numpy.searchsorted(sortedLabels, chunkLabels)]
+    return encode
+
+
+def writeTrainingSet(csvPath: str, outPath: str, chunkSize: int = 65536, dims: int = 4):
+    """Convert a CSV dataset into the binary format in two chunked passes"""
+    count, min, max, labels = scanCsv(csvPath, chunkSize, dims)
+    header, encoded = _header(count, dims, min, max, list(labels))
+    encode = labelEncoder(labels)
+    with open(outPath, 'wb') as out:
+        out.write(_PREFIX.pack(MAGIC, VERSION, len(encoded)))
+        out.write(encoded)
+        written = 0
+        bounds = (min, max)
+        for features, chunkLabels in knn.iterNormalized(csvPath, chunkSize, dims, bounds):
+            with profiling.timed('writeBinary'):
+                out.seek(header['featureOffset'] + written * dims * 4)
+                out.write(features.astype('<f4').tobytes())
+                out.seek(header['labelOffset'] + written * 4)
+                out.write(encode(chunkLabels).tobytes())
+                written += len(features)
+        out.truncate(header['labelOffset'] + count * 4)
+    return count
+
+
+def writeArrays(outPath: str, features, labelCodes, min, max, labels):
+    """Write normalized features and label codes already in memory in the same format"""
+    features = numpy.asarray(features, dtype='<f4')
+    header, encoded = _header(len(features), features.shape[1], min, max, list(labels))
+    with open(outPath, 'wb') as out:
+        out.write(_PREFIX.pack(MAGIC, VERSION, len(encoded)))
+        out.write(encoded)
+        out.seek(header['featureOffset'])
+        out.write(features.tobytes())
+        out.seek(header['labelOffset'])
+        out.write(numpy.asarray(labelCodes, dtype='<i4').tobytes())
+        out.truncate(header['labelOffset'] + len(features) * 4)
+    return len(features)
+
+
+def openTrainingSet(path: str) -> TrainingSet:
+    return TrainingSet(path)
+
+
+def _fallbackPath(csvPath: str) -> str:
+    """Cache file in the temp directory, for datasets kept in read-only directories"""
+    absolute = os.path.abspath(csvPath)
+    name = os.path.splitext(os.path.basename(absolute))[0]
+    digest = hashlib.sha1(absolute.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), '%s-%s.knn' % (name, digest))
+
+
+def _fresh(binPath: str, csvPath: str) -> bool:
+    return os.path.exists(binPath) and os.path.getmtime(binPath) >= os.path.getmtime(csvPath)
+
+
+def cachedTrainingSet(csvPath: str, binPath: str = None) -> TrainingSet:
+    """Open the binary form of csvPath, converting it first if missing or stale.
+
+    Without an explicit binPath the cache sits next to the CSV; when that
+    directory is not writable it goes to the temp directory instead.
+    """
+    if binPath is None:
+        binPath = os.path.splitext(csvPath)[0] + '.knn'
+        if not _fresh(binPath, csvPath) and not os.access(os.path.dirname(os.path.abspath(binPath)), os.W_OK):
+            binPath = _fallbackPath(csvPath)
+    if not _fresh(binPath, csvPath):
+        writeTrainingSet(csvPath, binPath + '.tmp')
+        os.replace(binPath + '.tmp', binPath)
+    return openTrainingSet(binPath)
+
+
+def main():
+    import time
+
+    start = time.perf_counter()
+    dataset = knn.normalizeData("iris.data")
+    csvTime = time.perf_counter() - start
+    start = time.perf_counter()
+    training = cachedTrainingSet("iris.data")
+    engine = training.engine()
+    openTime = time.perf_counter() - start
+    print('CSV parse + normalize: %.6fs, open binary: %.6fs' % (csvTime, openTime))
+    print('%d rows, %d labels' % (len(training), len(training.labels)))
+    nearest = engine.kneighbors([dataset[0]], 3)[0][0]
+    print('Nearest to first row: ' + repr([engine.rows[i] for i in nearest]))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,19 +3,242 @@ from datetime import datetime
 import random
 import sys
 import os
+import csv
+import json
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
-from rich import print as rprint
+from rich import print as rprint, get_console
+from rich.markup import escape
 import click
-from typing import Optional
+from typing import Optional, Iterable, Iterator, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sqlite_pool import ConnectionPool
+from sql_trace import SQLTracer, print_report
 
 console = Console()
 
+# PRAGMAs applied only for the duration of a bulk load
+BULK_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": "-65536",  # 64 MiB
+    "temp_store": "MEMORY",
+}
+
+# Recomputes order_stats_monthly from scratch
+ORDER_STATS_REBUILD_SQL = """
+DELETE FROM order_stats_monthly;
+INSERT INTO order_stats_monthly (month, order_count, item_count, total_items)
+SELECT IFNULL(strftime('%Y-%m', order_date), ''), COUNT(*), COUNT(quantity), IFNULL(SUM(quantity), 0)
+FROM orders
+GROUP BY 1;
+"""
+
+# Schema migrations applied in order on top of the base tables.
+# PRAGMA user_version records how many of them have run.
+MIGRATIONS = [
+    # 1: secondary indexes for the demo queries
+    """
+    CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
+    CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+    CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products(in_stock);
+    CREATE INDEX IF NOT EXISTS idx_orders_product_id ON orders(product_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_month
+        ON orders(strftime('%Y-%m', order_date), quantity);
+    """,
+    # 2: monthly order statistics kept up to date by triggers
+    """
+    CREATE TABLE IF NOT EXISTS order_stats_monthly (
+        month TEXT PRIMARY KEY,  -- '' collects orders without a date
+        order_count INTEGER NOT NULL DEFAULT 0,
+        item_count INTEGER NOT NULL DEFAULT 0,  -- orders with a quantity
+        total_items INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TRIGGER IF NOT EXISTS orders_stats_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT INTO order_stats_monthly (month, order_count, item_count, total_items)
+        VALUES (IFNULL(strftime('%Y-%m', NEW.order_date), ''), 1,
+                NEW.quantity IS NOT NULL, IFNULL(NEW.quantity, 0))
+        ON CONFLICT(month) DO UPDATE SET
+            order_count = order_count + 1,
+            item_count = item_count + excluded.item_count,
+            total_items = total_items + excluded.total_items;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS orders_stats_delete AFTER DELETE ON orders
+    BEGIN
+        UPDATE order_stats_monthly SET
+            order_count = order_count - 1,
+            item_count = item_count - (OLD.quantity IS NOT NULL),
+            total_items = total_items - IFNULL(OLD.quantity, 0)
+        WHERE month = IFNULL(strftime('%Y-%m', OLD.order_date), '');
+        DELETE FROM order_stats_monthly
+        WHERE month = IFNULL(strftime('%Y-%m', OLD.order_date), '') AND order_count <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS orders_stats_update AFTER UPDATE OF order_date, quantity ON orders
+    BEGIN
+        UPDATE order_stats_monthly SET
+            order_count = order_count - 1,
+            item_count = item_count - (OLD.quantity IS NOT NULL),
+            total_items = total_items - IFNULL(OLD.quantity, 0)
+        WHERE month = IFNULL(strftime('%Y-%m', OLD.order_date), '');
+        DELETE FROM order_stats_monthly
+        WHERE month = IFNULL(strftime('%Y-%m', OLD.order_date), '') AND order_count <= 0;
+        INSERT INTO order_stats_monthly (month, order_count, item_count, total_items)
+        VALUES (IFNULL(strftime('%Y-%m', NEW.order_date), ''), 1,
+                NEW.quantity IS NOT NULL, IFNULL(NEW.quantity, 0))
+        ON CONFLICT(month) DO UPDATE SET
+            order_count = order_count + 1,
+            item_count = item_count + excluded.item_count,
+            total_items = total_items + excluded.total_items;
+    END;
+
+    """ + ORDER_STATS_REBUILD_SQL,
+    # 3: product descriptions and an external-content FTS index over products
+    """
+    ALTER TABLE products ADD COLUMN description TEXT;
+
+    DROP TABLE IF EXISTS product_search;
+    CREATE VIRTUAL TABLE product_search
+    USING FTS5(name, description, content='products', content_rowid='id');
+
+    CREATE TRIGGER IF NOT EXISTS products_search_insert AFTER INSERT ON products
+    BEGIN
+        INSERT INTO product_search (rowid, name, description)
+        VALUES (NEW.id, NEW.name, NEW.description);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_search_delete AFTER DELETE ON products
+    BEGIN
+        INSERT INTO product_search (product_search, rowid, name, description)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_search_update AFTER UPDATE OF name, description ON products
+    BEGIN
+        INSERT INTO product_search (product_search, rowid, name, description)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description);
+        INSERT INTO product_search (rowid, name, description)
+        VALUES (NEW.id, NEW.name, NEW.description);
+    END;
+
+    INSERT INTO product_search (product_search) VALUES ('rebuild');
+    """,
+]
+
+# Matched terms in search results are wrapped in these control characters,
+# which product text does not contain; highlight_markup() turns them into
+# rich styles after escaping the text itself
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+# Ranked full-text search, one page at a time. Pages are walked with a keyset
+# on (bm25 score, rowid) rather than OFFSET, so deep pages cost the same as
+# the first one.
+SEARCH_SQL = """
+SELECT
+    p.id,
+    highlight(product_search, 0, char(2), char(3)) as name,
+    snippet(product_search, 1, char(2), char(3), '…', 12) as description,
+    bm25(product_search) as score
+FROM product_search
+JOIN products p ON p.id = product_search.rowid
+WHERE product_search MATCH :query
+  AND (:after_score IS NULL
+       OR bm25(product_search) > :after_score
+       OR (bm25(product_search) = :after_score AND product_search.rowid > :after_id))
+ORDER BY score, p.id
+LIMIT :limit
+"""
+
+# Monthly statistics recomputed from every order, the reference for the summary table
+MONTHLY_STATS_FULL_SQL = """
+SELECT
+    strftime('%Y-%m', order_date) as month,
+    COUNT(*) as order_count,
+    SUM(quantity) as total_items,
+    AVG(quantity) as avg_items
+FROM orders
+GROUP BY month
+HAVING order_count > 0
+ORDER BY month DESC
+"""
+
+# The same figures read from the maintained order_stats_monthly table
+MONTHLY_STATS_SQL = """
+SELECT
+    NULLIF(month, '') as month,
+    order_count,
+    CASE WHEN item_count > 0 THEN total_items END as total_items,
+    CASE WHEN item_count > 0 THEN total_items * 1.0 / item_count END as avg_items
+FROM order_stats_monthly
+WHERE order_count > 0
+ORDER BY order_stats_monthly.month DESC
+"""
+
+# The statements the demos run, checked by the explain command
+EXPLAIN_QUERIES = [
+    ("CRUD: select by price", "SELECT * FROM products WHERE price > ?", (500,)),
+    ("CRUD: update by price", "UPDATE products SET price = price * 1.1 WHERE price > ?", (500,)),
+    ("CRUD: delete out of stock", "DELETE FROM products WHERE in_stock = ?", (False,)),
+    ("Transactions: price by name", "SELECT price FROM products WHERE name = ?", ("Laptop",)),
+    ("Transactions: update by name", "UPDATE products SET price = price + 100.00 WHERE name = ?", ("Laptop",)),
+    ("Search: ranked page", SEARCH_SQL,
+     {"query": "laptop", "after_score": None, "after_id": None, "limit": 10}),
+    ("Aggregates: monthly orders", MONTHLY_STATS_SQL, ()),
+    ("Aggregates: full recompute", MONTHLY_STATS_FULL_SQL, ()),
+    ("Orders by product", "SELECT * FROM orders WHERE product_id = ?", (1,)),
+]
+
+
+def highlight_markup(text: str) -> str:
+    """Rich markup for a search result: the text escaped, its matches in bold yellow"""
+    return escape(text).replace(MATCH_START, "[bold yellow]").replace(MATCH_END, "[/bold yellow]")
+
+
+def classify_plan_step(detail: str) -> str:
+    """Rate one EXPLAIN QUERY PLAN step: FULL SCAN, INDEX SCAN, TEMP B-TREE or OK"""
+    if detail.startswith("SCAN"):
+        if "VIRTUAL TABLE" in detail:
+            return "OK"
+        if " USING " in detail:
+            return "INDEX SCAN"
+        return "FULL SCAN"
+    if "TEMP B-TREE" in detail:
+        return "TEMP B-TREE"
+    return "OK"
+
+
+def generate_products(count: int, seed: int = 42) -> Iterator[Tuple[str, float, bool]]:
+    """Yield count synthetic (name, price, in_stock) rows"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield (f"Product {i:08d}", round(rng.uniform(1, 2000), 2), rng.random() < 0.9)
+
+
+def read_products_csv(path: str) -> Iterator[Tuple[str, float, bool]]:
+    """Yield (name, price, in_stock) rows from a CSV file with a header row"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            in_stock = row.get("in_stock", "1").strip().lower() in ("1", "true", "yes", "y")
+            yield (row["name"], float(row["price"]), in_stock)
+
 class SQLiteDemo:
-    def __init__(self, db_name="demo.db"):
+    def __init__(self, db_name="demo.db", tracer: Optional[SQLTracer] = None):
         self.db_name = db_name
-        self.conn = sqlite3.connect(db_name)
+        # with a tracer every statement on the pool's connections is timed
+        self.tracer = tracer
+        self.pool = ConnectionPool(db_name, factory=tracer.factory if tracer else sqlite3.Connection)
+        self.conn = self.pool.connection()
         self.cursor = self.conn.cursor()
         self.setup_database()
 
@@ -36,11 +259,29 @@ class SQLiteDemo:
             order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (product_id) REFERENCES products(id)
         );
-
-        CREATE VIRTUAL TABLE IF NOT EXISTS product_search
-        USING FTS5(name, description);
         """)
         self.conn.commit()
+        self.migrate_schema()
+
+    def migrate_schema(self):
+        """Apply the MIGRATIONS this database has not seen yet"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], version + 1):
+            self.cursor.executescript(f"""
+            BEGIN;
+            {script}
+            PRAGMA user_version = {number};
+            COMMIT;
+            """)
+
+    def explain_queries(self):
+        """EXPLAIN QUERY PLAN for every demo statement as (label, detail, rating) rows"""
+        steps = []
+        for label, sql, params in EXPLAIN_QUERIES:
+            for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+                detail = row[3]
+                steps.append((label, detail, classify_plan_step(detail)))
+        return steps
 
     def demo_basic_operations(self):
         """Demonstrate basic CRUD operations"""
@@ -125,50 +366,63 @@ class SQLiteDemo:
                 )
                 console.print(table)
 
-    def demo_full_text_search(self):
+    def demo_full_text_search(self, search_term: str = "laptop", limit: int = 10, pages: int = 1):
         """Demonstrate full-text search capabilities"""
         with console.status("[bold green]Setting up full-text search demo..."):
             sample_products = [
-                ("Gaming Laptop", "High-performance gaming laptop with RGB keyboard"),
-                ("Business Laptop", "Professional laptop for office work"),
-                ("Student Notebook", "Affordable laptop for students")
+                ("Gaming Laptop", 1499.99, True, "High-performance gaming laptop with RGB keyboard"),
+                ("Business Laptop", 1099.99, True, "Professional laptop for office work"),
+                ("Student Notebook", 549.99, True, "Affordable laptop for students")
             ]
 
+            # The index follows products through triggers, so only missing
+            # samples are added
             self.cursor.executemany("""
-            INSERT INTO product_search (name, description)
-            VALUES (?, ?)
+            INSERT INTO products (name, price, in_stock, description)
+            SELECT ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM products WHERE name = ?1)
             """, sample_products)
+            self.conn.commit()
 
-            search_term = "laptop"
-            self.cursor.execute("""
-            SELECT * FROM product_search
-            WHERE product_search MATCH ?
-            ORDER BY rank
-            """, (search_term,))
+            after = None
+            for page in range(1, pages + 1):
+                rows, after = self.search_products(search_term, limit, after)
 
-            table = Table(title=f"Search Results for '{search_term}'")
-            table.add_column("Name", style="cyan")
-            table.add_column("Description", style="green")
+                table = Table(title=f"Search Results for '{search_term}' (page {page})")
+                table.add_column("Name", style="cyan")
+                table.add_column("Description", style="green")
+                table.add_column("Score", style="magenta")
 
-            for row in self.cursor.fetchall():
-                table.add_row(row[0], row[1])
+                for _, name, description, score in rows:
+                    table.add_row(highlight_markup(name), highlight_markup(description or ""), f"{score:.4g}")
 
-            console.print(table)
+                console.print(table)
+                if after is None:
+                    break
+
+    def search_products(self, query: str, limit: int = 10, after: Optional[Tuple[float, int]] = None):
+        """One page of (id, name, snippet, score) matches, best first.
+
+        Matched terms in name and snippet are wrapped in MATCH_START and
+        MATCH_END. Pass the returned cursor as after to get the next page;
+        it is None once there are no more results.
+        """
+        after_score, after_id = after if after is not None else (None, None)
+        rows = self.conn.execute(SEARCH_SQL, {
+            "query": query, "after_score": after_score, "after_id": after_id, "limit": limit,
+        }).fetchall()
+        cursor = (rows[-1][3], rows[-1][0]) if len(rows) == limit else None
+        return rows, cursor
+
+    def optimize_search_index(self):
+        """Merge the FTS index b-trees into one for faster queries"""
+        self.conn.execute("INSERT INTO product_search (product_search) VALUES ('optimize')")
+        self.conn.commit()
 
     def demo_aggregate_functions(self):
         """Demonstrate aggregate functions and GROUP BY"""
         with console.status("[bold green]Calculating aggregates..."):
-            self.cursor.execute("""
-            SELECT
-                strftime('%Y-%m', order_date) as month,
-                COUNT(*) as order_count,
-                SUM(quantity) as total_items,
-                AVG(quantity) as avg_items
-            FROM orders
-            GROUP BY month
-            HAVING order_count > 0
-            ORDER BY month DESC
-            """)
+            self.cursor.execute(MONTHLY_STATS_SQL)
 
             table = Table(title="Monthly Order Statistics")
             table.add_column("Month", style="cyan")
@@ -181,6 +435,66 @@ class SQLiteDemo:
 
             console.print(table)
 
+    def refresh_order_stats(self):
+        """Rebuild order_stats_monthly from the orders table"""
+        self.cursor.executescript(f"BEGIN; {ORDER_STATS_REBUILD_SQL} COMMIT;")
+
+    def check_order_stats(self):
+        """Months where the summary table and a full recompute disagree, as (month, summary, full)"""
+        summary = {row[0]: row[1:] for row in self.conn.execute(MONTHLY_STATS_SQL)}
+        full = {row[0]: row[1:] for row in self.conn.execute(MONTHLY_STATS_FULL_SQL)}
+        mismatches = []
+        for month in sorted(set(summary) | set(full), key=lambda m: m or ""):
+            a, b = summary.get(month), full.get(month)
+            same = a is not None and b is not None and a[:2] == b[:2] and (
+                a[2] == b[2] or (a[2] is not None and b[2] is not None and abs(a[2] - b[2]) < 1e-9))
+            if not same:
+                mismatches.append((month, a, b))
+        return mismatches
+
+    @contextmanager
+    def bulk_pragmas(self, pragmas: Optional[dict] = None):
+        """Apply bulk-load PRAGMAs and restore the previous values afterwards"""
+        pragmas = BULK_PRAGMAS if pragmas is None else pragmas
+        previous = {}
+        for name, value in pragmas.items():
+            previous[name] = self.conn.execute(f"PRAGMA {name}").fetchone()[0]
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                self.conn.execute(f"PRAGMA {name} = {value}")
+
+    def bulk_insert_products(self, rows: Iterable[Tuple[str, float, bool]],
+                             batch_size: int = 50000, tune_pragmas: bool = True) -> dict:
+        """Insert (name, price, in_stock) rows with executemany, one transaction per batch"""
+        self.conn.commit()
+        inserted = 0
+        rows = iter(rows)
+        start = time.perf_counter()
+        with (self.bulk_pragmas() if tune_pragmas else nullcontext()):
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                try:
+                    self.cursor.executemany("""
+                    INSERT INTO products (name, price, in_stock)
+                    VALUES (?, ?, ?)
+                    """, batch)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                inserted += len(batch)
+        elapsed = time.perf_counter() - start
+        return {
+            "rows": inserted,
+            "seconds": elapsed,
+            "rows_per_second": inserted / elapsed if elapsed else float("inf"),
+        }
+
     def run_all_demos(self):
         """Run all demonstration methods"""
         rprint("\n[bold blue]Running All Demos[/bold blue]")
@@ -191,7 +505,7 @@ class SQLiteDemo:
 
     def drop_database(self):
         """Drop the database file"""
-        self.conn.close()
+        self.pool.close_all()
         try:
             os.remove(self.db_name)
             rprint(f"[green]Database {self.db_name} has been dropped successfully.[/green]")
@@ -258,16 +572,48 @@ def transactions():
     demo.demo_transactions()
 
 @cli.command()
-def search():
+@click.option("--term", default="laptop", show_default=True, help="FTS5 query to run")
+@click.option("--limit", type=int, default=10, show_default=True, help="Results per page")
+@click.option("--pages", type=int, default=1, show_default=True, help="Pages to show")
+def search(term, limit, pages):
     """Run full-text search demo"""
     demo = SQLiteDemo()
-    demo.demo_full_text_search()
+    demo.demo_full_text_search(term, limit, pages)
 
 @cli.command()
-def aggregates():
+def optimize():
+    """Optimize the full-text search index"""
+    demo = SQLiteDemo()
+    with console.status("[bold green]Optimizing search index..."):
+        demo.optimize_search_index()
+    rprint("[green]Search index optimized[/green]")
+
+@cli.command()
+@click.option("--verify", is_flag=True, help="Check the summary table against a full recompute")
+def aggregates(verify):
     """Run aggregate functions demo"""
     demo = SQLiteDemo()
     demo.demo_aggregate_functions()
+    if verify:
+        mismatches = demo.check_order_stats()
+        if not mismatches:
+            rprint("[green]order_stats_monthly matches the full recompute[/green]")
+        else:
+            table = Table(title="order_stats_monthly Mismatches")
+            table.add_column("Month", style="cyan")
+            table.add_column("Summary", style="yellow")
+            table.add_column("Full Recompute", style="green")
+            for month, summary, full in mismatches:
+                table.add_row(str(month), str(summary), str(full))
+            console.print(table)
+            sys.exit(1)
+
+@cli.command(name="refresh-stats")
+def refresh_stats():
+    """Rebuild the monthly order statistics table"""
+    demo = SQLiteDemo()
+    demo.refresh_order_stats()
+    rprint("[green]order_stats_monthly rebuilt[/green]")
 
 @cli.command()
 def all():
@@ -275,5 +621,85 @@ def all():
     demo = SQLiteDemo()
     demo.run_all_demos()
 
+@cli.command(name="bulk-load")
+@click.option("--rows", "count", type=int, default=100000, show_default=True,
+              help="Number of generated products to load")
+@click.option("--csv", "csv_path", type=click.Path(exists=True, dir_okay=False),
+              help="Load products from a CSV file (name,price,in_stock) instead")
+@click.option("--batch-size", type=int, default=50000, show_default=True,
+              help="Rows per executemany call and transaction")
+@click.option("--no-pragmas", is_flag=True, help="Load with the connection's normal PRAGMAs")
+@click.option("--seed", type=int, default=42, show_default=True, help="Seed for generated rows")
+def bulk_load(count, csv_path, batch_size, no_pragmas, seed):
+    """Bulk-load products and report throughput"""
+    demo = SQLiteDemo()
+    rows = read_products_csv(csv_path) if csv_path else generate_products(count, seed)
+    with console.status("[bold green]Bulk loading products..."):
+        stats = demo.bulk_insert_products(rows, batch_size, tune_pragmas=not no_pragmas)
+
+    table = Table(title="Bulk Load")
+    table.add_column("Metric", style="cyan")
+    table.add_column("Value", style="green")
+    table.add_row("Rows", f"{stats['rows']:,}")
+    table.add_row("Batch size", f"{batch_size:,}")
+    table.add_row("Bulk PRAGMAs", "off" if no_pragmas else "on")
+    table.add_row("Elapsed", f"{stats['seconds']:.2f}s")
+    table.add_row("Rows/second", f"{stats['rows_per_second']:,.0f}")
+    console.print(table)
+
+@cli.command()
+@click.option("--strict", is_flag=True, help="Exit with status 1 if any full table scan remains")
+def explain(strict):
+    """Show query plans for the demo queries and flag table scans"""
+    demo = SQLiteDemo()
+    steps = demo.explain_queries()
+    styles = {"FULL SCAN": "bold red", "INDEX SCAN": "yellow", "TEMP B-TREE": "yellow", "OK": "green"}
+
+    table = Table(title="Query Plans")
+    table.add_column("Query", style="cyan")
+    table.add_column("Plan", style="white")
+    table.add_column("Status")
+    for label, detail, rating in steps:
+        table.add_row(label, detail, f"[{styles[rating]}]{rating}[/{styles[rating]}]")
+    console.print(table)
+
+    full_scans = sum(1 for _, _, rating in steps if rating == "FULL SCAN")
+    if full_scans:
+        rprint(f"[bold red]{full_scans} full table scan(s) found[/bold red]")
+        if strict:
+            sys.exit(1)
+    else:
+        rprint("[green]No full table scans[/green]")
+
+@cli.command()
+@click.option("--rounds", type=int, default=3, show_default=True, help="Times to run the demo workload")
+@click.option("--slow-ms", type=float, default=50.0, show_default=True, help="Slow-query log threshold")
+@click.option("--limit", type=int, default=15, show_default=True, help="Statements to show")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON instead of tables")
+def stats(rounds, slow_ms, limit, as_json):
+    """Trace every statement of the demo workload and report per-statement latency"""
+    tracer = SQLTracer(slow_ms=slow_ms)
+    # the demos insert and update rows, so they run on a scratch database
+    workdir = tempfile.mkdtemp(prefix="sqlite-demo-stats-")
+    rich_console = get_console()
+    quiet = console.quiet, rich_console.quiet
+    console.quiet = rich_console.quiet = True
+    demo = None
+    try:
+        demo = SQLiteDemo(os.path.join(workdir, "demo.db"), tracer=tracer)
+        for _ in range(rounds):
+            demo.run_all_demos()
+            demo.explain_queries()
+            demo.search_products("laptop", limit=10)
+    finally:
+        console.quiet, rich_console.quiet = quiet
+        if demo is not None:
+            demo.pool.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if as_json:
+        click.echo(json.dumps({"statements": tracer.report(), "slow_queries": list(tracer.slow_log)}, indent=2))
+    else:
+        print_report(tracer, console, limit)
+
 if __name__ == "__main__":
     cli()
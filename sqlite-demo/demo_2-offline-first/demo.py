@@ -11,42 +11,80 @@ import click
 from typing import Optional
 import queue
 import threading
-import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sqlite_pool import ConnectionPool
+from group_commit import GroupCommitWriter
+from sql_trace import SQLTracer, print_report
+from sync_engine import Backoff, SimulatedTransport, SyncEngine, SyncResult, Transport
 
 console = Console()
 
+# Put on sync_queue to wake the worker without a new transaction (shutdown)
+WAKE = object()
+# Put on sync_queue when the device comes back online: the worker drops its
+# backoff and syncs right away
+ONLINE = object()
+
 class OfflineFirstDemo:
-    def __init__(self, db_name="edge.db"):
+    def __init__(self, db_name="edge.db", transport: Optional[Transport] = None,
+                 batch_size: int = 50, concurrency: int = 4, coalesce_window: float = 0.05,
+                 commit_window: float = 0.0, commit_batch: int = 256, tracer: Optional[SQLTracer] = None):
         self.db_name = db_name
-        self.conn = sqlite3.connect(db_name)
+        # with a tracer every statement on the pool's connections is timed
+        self.tracer = tracer
+        self.pool = ConnectionPool(db_name, factory=tracer.factory if tracer else sqlite3.Connection)
+        self.conn = self.pool.connection()
         self.cursor = self.conn.cursor()
         self.sync_queue = queue.Queue()
+        self.transport = transport or SimulatedTransport()
+        self.sync_engine = SyncEngine(self.transport, batch_size=batch_size, concurrency=concurrency)
         self.setup_database()
+        # record_transaction's writes share commits through this writer; sync_log rows are
+        # written by the sync engine in the same transaction as the status updates they describe
+        self.writer = GroupCommitWriter(self.pool, window=commit_window, max_batch=commit_batch)
         self.sync_thread = None
         self.is_online = False
         self.sync_running = False
+        # how long the worker keeps collecting events before a sync pass
+        self.coalesce_window = coalesce_window
+        # called on the worker thread after every batch it writes back
+        self.on_sync_batch = None
 
     def show_sync_status(self):
             """Display sync status information"""
-            self.cursor.execute("""
-            SELECT
-                COUNT(*) as total,
-                SUM(CASE WHEN synced = 1 THEN 1 ELSE 0 END) as synced,
-                SUM(CASE WHEN synced = 0 AND retry_count < 3 THEN 1 ELSE 0 END) as pending,
-                SUM(CASE WHEN retry_count >= 3 THEN 1 ELSE 0 END) as failed
-            FROM transactions
-            """)
-
-            stats = self.cursor.fetchone()
+            stats = self.sync_counts()
 
             table = Table(title="Sync Status")
             table.add_column("Metric", style="cyan")
             table.add_column("Count", style="green")
 
-            table.add_row("Total Transactions", str(stats[0]))
-            table.add_row("Synced", str(stats[1]))
-            table.add_row("Pending", str(stats[2]))
-            table.add_row("Failed", str(stats[3]))
+            table.add_row("Total Transactions", str(stats["total"]))
+            table.add_row("Synced", str(stats["synced"]))
+            table.add_row("Pending", str(stats["pending"]))
+            table.add_row("Failed", str(stats["failed"]))
+            console.print(table)
+
+            pool_stats = self.pool.stats()
+            table = Table(title="Connection Pool")
+            table.add_column("Metric", style="cyan")
+            table.add_column("Value", style="green")
+            table.add_row("Open / In Use", f"{pool_stats['open']} / {pool_stats['in_use']}")
+            table.add_row("Checkouts", str(pool_stats["checkouts"]))
+            table.add_row("Waits", str(pool_stats["waits"]))
+            table.add_row("Avg / Max Wait", f"{pool_stats['avg_wait_seconds'] * 1000:.1f} ms / "
+                                            f"{pool_stats['max_wait_seconds'] * 1000:.1f} ms")
+            console.print(table)
+
+            writer_stats = self.writer.stats()
+            table = Table(title="Group Commit")
+            table.add_column("Metric", style="cyan")
+            table.add_column("Value", style="green")
+            table.add_row("Writes / Commits", f"{writer_stats['writes']} / {writer_stats['commits']}")
+            table.add_row("Avg / Max Group", f"{writer_stats['avg_group']:.1f} / {writer_stats['max_group']}")
+            table.add_row("Errors", str(writer_stats["errors"]))
             console.print(table)
 
     def setup_database(self):
@@ -60,7 +98,8 @@ class OfflineFirstDemo:
             description TEXT,
             synced INTEGER DEFAULT 0,
             sync_timestamp DATETIME,
-            retry_count INTEGER DEFAULT 0
+            retry_count INTEGER DEFAULT 0,
+            next_retry_at REAL  -- epoch seconds; a rejected row is left out of passes until then
         );
 
         -- Sync log for debugging and monitoring
@@ -80,44 +119,119 @@ class OfflineFirstDemo:
         """)
         self.conn.commit()
 
-    def log_sync_event(self, event_type: str, details: str):
-        """Record sync-related events"""
-        self.cursor.execute("""
-        INSERT INTO sync_log (event_type, details)
-        VALUES (?, ?)
-        """, (event_type, details))
-        self.conn.commit()
+        # databases created before next_retry_at existed
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(transactions)")]
+        if "next_retry_at" not in columns:
+            self.conn.execute("ALTER TABLE transactions ADD COLUMN next_retry_at REAL")
+            self.conn.commit()
+
+        # Outbox: the sync pass reads unsynced rows through a partial index,
+        # and the status view reads counters kept by triggers, so neither
+        # cost grows with the synced history
+        self.cursor.executescript("""
+        BEGIN IMMEDIATE;
+
+        CREATE INDEX IF NOT EXISTS idx_transactions_pending
+        ON transactions(timestamp) WHERE synced = 0;
+
+        CREATE TABLE IF NOT EXISTS sync_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Backfill only when the counters are new, the triggers keep them after that.
+        -- Each count is a scalar subquery, only evaluated when its row passes the guard.
+        INSERT INTO sync_counters (name, value)
+        SELECT 'total', (SELECT COUNT(*) FROM transactions)
+            WHERE NOT EXISTS (SELECT 1 FROM sync_counters)
+        UNION ALL SELECT 'synced', (SELECT COUNT(*) FROM transactions WHERE synced = 1)
+            WHERE NOT EXISTS (SELECT 1 FROM sync_counters)
+        UNION ALL SELECT 'pending', (SELECT COUNT(*) FROM transactions WHERE synced <> 1 AND retry_count < 3)
+            WHERE NOT EXISTS (SELECT 1 FROM sync_counters)
+        UNION ALL SELECT 'failed', (SELECT COUNT(*) FROM transactions WHERE synced <> 1 AND retry_count >= 3)
+            WHERE NOT EXISTS (SELECT 1 FROM sync_counters);
+
+        CREATE TRIGGER IF NOT EXISTS transactions_count_insert AFTER INSERT ON transactions
+        BEGIN
+            UPDATE sync_counters SET value = value + 1 WHERE name = 'total';
+            UPDATE sync_counters SET value = value + 1 WHERE name =
+                CASE WHEN NEW.synced = 1 THEN 'synced' WHEN NEW.retry_count >= 3 THEN 'failed' ELSE 'pending' END;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS transactions_count_update AFTER UPDATE OF synced, retry_count ON transactions
+        WHEN (CASE WHEN OLD.synced = 1 THEN 'synced' WHEN OLD.retry_count >= 3 THEN 'failed' ELSE 'pending' END)
+          <> (CASE WHEN NEW.synced = 1 THEN 'synced' WHEN NEW.retry_count >= 3 THEN 'failed' ELSE 'pending' END)
+        BEGIN
+            UPDATE sync_counters SET value = value - 1 WHERE name =
+                CASE WHEN OLD.synced = 1 THEN 'synced' WHEN OLD.retry_count >= 3 THEN 'failed' ELSE 'pending' END;
+            UPDATE sync_counters SET value = value + 1 WHERE name =
+                CASE WHEN NEW.synced = 1 THEN 'synced' WHEN NEW.retry_count >= 3 THEN 'failed' ELSE 'pending' END;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS transactions_count_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE sync_counters SET value = value - 1 WHERE name = 'total';
+            UPDATE sync_counters SET value = value - 1 WHERE name =
+                CASE WHEN OLD.synced = 1 THEN 'synced' WHEN OLD.retry_count >= 3 THEN 'failed' ELSE 'pending' END;
+        END;
+
+        COMMIT;
+        """)
+
+    def sync_counts(self) -> dict:
+        """Total, synced, pending and failed transaction counts from the maintained counters"""
+        counts = dict(self.conn.execute("SELECT name, value FROM sync_counters"))
+        return {name: counts.get(name, 0) for name in ("total", "synced", "pending", "failed")}
+
+    def record_transaction(self, amount: float, description: str, wait: bool = True) -> Optional[str]:
+        """Record a new transaction locally, returning its id (None if it could not be stored).
 
-    def record_transaction(self, amount: float, description: str):
-        """Record a new transaction locally"""
+        With wait (the default) this returns once the transaction is on
+        disk. Without it, the id is returned straight away and the commit
+        happens with the writer's next group. Either way the transaction is
+        only handed to the sync worker after it has been committed.
+        """
         transaction_id = str(uuid.uuid4())
         try:
-            self.cursor.execute("""
+            future = self.writer.submit("""
             INSERT INTO transactions (id, amount, description)
             VALUES (?, ?, ?)
             """, (transaction_id, amount, description))
-            self.conn.commit()
 
-            self.sync_queue.put(transaction_id)
+            def committed(future):
+                if future.exception() is None:
+                    self.sync_queue.put(transaction_id)
+                elif not wait:
+                    console.print(f"[red]Error recording transaction {transaction_id}: {future.exception()}[/red]")
+            future.add_done_callback(committed)
+            if not wait:
+                return transaction_id
+
+            future.result()
             console.print(f"[green]Transaction recorded locally: {transaction_id}[/green]")
 
-            # Try immediate sync if online
-            if self.is_online:
+            # Without a background worker, try an immediate sync if online
+            if self.is_online and not self.sync_running:
                 self.sync_pending_transactions()
+            return transaction_id
 
         except Exception as e:
             console.print(f"[red]Error recording transaction: {e}[/red]")
+            return None
 
     def simulate_server_sync(self, transaction_id: str) -> bool:
         """Simulate syncing with a remote server"""
-        # Simulate network latency
-        time.sleep(random.uniform(0.1, 0.5))
-
-        # Simulate occasional network failures
-        if random.random() < 0.2:  # 20% chance of failure
-            return False
-
-        return True
+        return self.transport.send_batch([(transaction_id, None, None)])[transaction_id]
+
+    def report_sync_result(self, result: SyncResult):
+        """Print a summary of one sync pass"""
+        if result.synced:
+            console.print(f"[green]Synced {result.synced} transaction(s) in {result.batches} batch(es), "
+                          f"{result.seconds:.2f}s[/green]")
+        if result.failed:
+            console.print(f"[red]Failed to sync {result.failed} transaction(s), will retry[/red]")
+        if result.errors:
+            console.print(f"[red]{result.errors} transaction(s) hit a transport error[/red]")
 
     def sync_pending_transactions(self):
         """Sync pending transactions to the server"""
@@ -125,126 +239,97 @@ class OfflineFirstDemo:
             console.print("[yellow]Device is offline. Transactions will sync when connection is restored.[/yellow]")
             return
 
-        self.cursor.execute("""
-        SELECT id, amount, description
-        FROM transactions
-        WHERE synced = 0 AND retry_count < 3
-        ORDER BY timestamp
-        """)
-
-        pending = self.cursor.fetchall()
+        result = self.sync_engine.sync_pending(self.conn)
 
-        if not pending:
+        if not result.pending:
             console.print("[green]No pending transactions to sync[/green]")
             return
 
-        for transaction in pending:
-            transaction_id, amount, description = transaction
-
-            try:
-                # Attempt to sync with simulated server
-                sync_success = self.simulate_server_sync(transaction_id)
-
-                if sync_success:
-                    self.cursor.execute("""
-                    UPDATE transactions
-                    SET synced = 1, sync_timestamp = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                    """, (transaction_id,))
-                    self.log_sync_event("sync_success", f"Transaction {transaction_id} synced successfully")
-                    console.print(f"[green]Synced transaction: {transaction_id}[/green]")
-                else:
-                    self.cursor.execute("""
-                    UPDATE transactions
-                    SET retry_count = retry_count + 1
-                    WHERE id = ?
-                    """, (transaction_id,))
-                    self.log_sync_event("sync_failure", f"Failed to sync transaction {transaction_id}")
-                    console.print(f"[red]Failed to sync transaction: {transaction_id}[/red]")
-
-                self.conn.commit()
-
-            except Exception as e:
-                self.log_sync_event("sync_error", f"Error syncing {transaction_id}: {str(e)}")
-                console.print(f"[red]Error syncing transaction {transaction_id}: {e}[/red]")
+        self.report_sync_result(result)
 
     def start_sync_worker(self):
-            """Start background sync worker"""
+            """Start background sync worker.
+
+            The worker sleeps on sync_queue and wakes for new transactions,
+            connectivity changes, or a scheduled retry. After waking it
+            collects more events for coalesce_window seconds before a sync
+            pass. A transport error (server unreachable) holds all sending
+            for a jittered exponential backoff, or until the device comes
+            back online. A rejected transaction does not hold back new ones:
+            it waits out its own backoff (next_retry_at, see SyncEngine) and
+            the worker wakes when the earliest one is due.
+            """
             self.sync_running = True
 
             def worker():
-                # Create a new connection for this thread
-                worker_conn = sqlite3.connect(self.db_name)
-                worker_cursor = worker_conn.cursor()
+                # The sync thread gets its own pooled connection
+                worker_conn = self.pool.connection()
+                backoff = Backoff()
+                retry_at = None   # next pass after a transport error, or when a rejected row is due
+                blocked = False   # server unreachable, wait for retry_at
+                dirty = True      # there may be work, e.g. left from a previous run
 
                 try:
                     while self.sync_running:
-                        if self.is_online:
-                            # Using the thread's connection to check pending transactions
-                            worker_cursor.execute("""
-                            SELECT id, amount, description
-                            FROM transactions
-                            WHERE synced = 0 AND retry_count < 3
-                            ORDER BY timestamp
-                            """)
-
-                            pending = worker_cursor.fetchall()
-
-                            if pending:
-                                for transaction in pending:
-                                    transaction_id, amount, description = transaction
-
-                                    try:
-                                        # Attempt to sync with simulated server
-                                        sync_success = self.simulate_server_sync(transaction_id)
-
-                                        if sync_success:
-                                            worker_cursor.execute("""
-                                            UPDATE transactions
-                                            SET synced = 1, sync_timestamp = CURRENT_TIMESTAMP
-                                            WHERE id = ?
-                                            """, (transaction_id,))
-
-                                            worker_cursor.execute("""
-                                            INSERT INTO sync_log (event_type, details)
-                                            VALUES (?, ?)
-                                            """, ("sync_success", f"Transaction {transaction_id} synced successfully"))
-
-                                            console.print(f"[green]Synced transaction: {transaction_id}[/green]")
-                                        else:
-                                            worker_cursor.execute("""
-                                            UPDATE transactions
-                                            SET retry_count = retry_count + 1
-                                            WHERE id = ?
-                                            """, (transaction_id,))
-
-                                            worker_cursor.execute("""
-                                            INSERT INTO sync_log (event_type, details)
-                                            VALUES (?, ?)
-                                            """, ("sync_failure", f"Failed to sync transaction {transaction_id}"))
-
-                                            console.print(f"[red]Failed to sync transaction: {transaction_id}[/red]")
-
-                                        worker_conn.commit()
-
-                                    except Exception as e:
-                                        worker_cursor.execute("""
-                                        INSERT INTO sync_log (event_type, details)
-                                        VALUES (?, ?)
-                                        """, ("sync_error", f"Error syncing {transaction_id}: {str(e)}"))
-                                        worker_conn.commit()
-                                        console.print(f"[red]Error syncing transaction {transaction_id}: {e}[/red]")
-
-                        time.sleep(5)  # Check every 5 seconds
+                        now = time.monotonic()
+                        due = retry_at is not None and now >= retry_at
+                        if self.is_online and (due or (dirty and not blocked)):
+                            self._coalesce()
+                            if not self.sync_running:
+                                break
+                            dirty = False
+                            try:
+                                result = self.sync_engine.sync_pending(worker_conn, self.on_sync_batch)
+                                if result.pending:
+                                    self.report_sync_result(result)
+                                blocked = bool(result.errors)
+                                if not blocked:
+                                    backoff.reset()
+                                    wait = self.sync_engine.next_retry_delay(worker_conn)
+                                    retry_at = None if wait is None else time.monotonic() + wait
+                            except Exception as e:
+                                console.print(f"[red]Sync worker error: {e}[/red]")
+                                blocked = True
+                            if blocked:
+                                retry_at = time.monotonic() + backoff.next_delay()
+                            continue
+
+                        # Nothing to do until an event arrives or a retry is due
+                        timeout = None
+                        if self.is_online and retry_at is not None:
+                            timeout = max(0.0, retry_at - now)
+                        try:
+                            event = self.sync_queue.get(timeout=timeout)
+                            dirty = True
+                            if event is ONLINE:
+                                # the connection is back, don't sit out the old backoff
+                                backoff.reset()
+                                blocked = False
+                                retry_at = None
+                        except queue.Empty:
+                            pass
                 finally:
-                    worker_conn.close()
+                    self.pool.release_thread()
 
             self.sync_thread = threading.Thread(target=worker, daemon=True)
             self.sync_thread.start()
 
+    def _coalesce(self):
+        """Drain sync_queue for coalesce_window seconds so a burst syncs in one pass"""
+        deadline = time.monotonic() + self.coalesce_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self.sync_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
     def stop_sync_worker(self):
         """Stop background sync worker"""
         self.sync_running = False
+        self.sync_queue.put(WAKE)
         if self.sync_thread:
             self.sync_thread.join()
 
@@ -253,7 +338,10 @@ class OfflineFirstDemo:
         self.is_online = not self.is_online
         if self.is_online:
             console.print("[bold green]Device is now ONLINE[/bold green]")
-            self.sync_pending_transactions()
+            if self.sync_running:
+                self.sync_queue.put(ONLINE)
+            else:
+                self.sync_pending_transactions()
         else:
             console.print("[bold red]Device is now OFFLINE[/bold red]")
 
@@ -265,9 +353,11 @@ def cli(ctx):
         ctx.invoke(interactive)
 
 @cli.command()
-def interactive():
+@click.option("--batch-size", type=int, default=50, show_default=True, help="Transactions per sync request")
+@click.option("--concurrency", type=int, default=4, show_default=True, help="Sync requests in flight at once")
+def interactive(batch_size, concurrency):
     """Start interactive demo mode"""
-    demo = OfflineFirstDemo()
+    demo = OfflineFirstDemo(batch_size=batch_size, concurrency=concurrency)
     demo.start_sync_worker()
 
     while True:
@@ -313,10 +403,74 @@ def interactive():
             console.print(table)
         elif choice == 'Q':
             demo.stop_sync_worker()
+            demo.writer.close()
             console.print("[yellow]Exiting demo...[/yellow]")
             break
         else:
             console.print("[red]Invalid choice. Please try again.[/red]")
 
+@cli.command()
+@click.option("--transactions", "count", type=int, default=1000, show_default=True, help="Transactions to record")
+@click.option("--seed", type=int, default=42, show_default=True, help="Seed for the workload and the server's decisions")
+@click.option("--rate", type=float, default=200.0, show_default=True,
+              help="Mean transactions recorded per second, 0 for all at once")
+@click.option("--schedule", default="on:5,off:1", show_default=True,
+              help="Repeating connectivity periods, e.g. on:5,off:1 (seconds)")
+@click.option("--failure-rate", type=float, default=0.2, show_default=True,
+              help="Chance the server rejects a transaction")
+@click.option("--error-rate", type=float, default=0.0, show_default=True,
+              help="Chance a whole request fails while online")
+@click.option("--min-latency", type=float, default=0.01, show_default=True, help="Server latency per request, lower bound")
+@click.option("--max-latency", type=float, default=0.05, show_default=True, help="Server latency per request, upper bound")
+@click.option("--batch-size", type=int, default=50, show_default=True, help="Transactions per sync request")
+@click.option("--concurrency", type=int, default=4, show_default=True, help="Sync requests in flight at once")
+@click.option("--coalesce-window", type=float, default=0.05, show_default=True,
+              help="Seconds the worker collects events before a sync pass")
+@click.option("--timeout", type=float, default=120.0, show_default=True, help="Give up after this many seconds")
+@click.option("--no-wait", is_flag=True, help="Record without waiting for each commit")
+@click.option("--out", type=click.Path(dir_okay=False), help="Write the JSON report here instead of stdout")
+def bench(count, seed, rate, schedule, failure_rate, error_rate, min_latency, max_latency,
+          batch_size, concurrency, coalesce_window, timeout, no_wait, out):
+    """Headless sync benchmark against a local stand-in server, reported as JSON"""
+    from sync_bench import parse_schedule, run_benchmark
+
+    try:
+        parse_schedule(schedule)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--schedule")
+    report = run_benchmark(count, seed, rate, schedule, failure_rate, error_rate, min_latency,
+                           max_latency, batch_size, concurrency, coalesce_window, timeout,
+                           wait=not no_wait)
+    text = json.dumps(report, indent=2)
+    if out:
+        with open(out, "w") as f:
+            f.write(text + "\n")
+    else:
+        click.echo(text)
+
+@cli.command()
+@click.option("--transactions", "count", type=int, default=1000, show_default=True, help="Transactions to record")
+@click.option("--seed", type=int, default=42, show_default=True, help="Seed for the workload and the server's decisions")
+@click.option("--schedule", default="on:5,off:1", show_default=True,
+              help="Repeating connectivity periods, e.g. on:5,off:1 (seconds)")
+@click.option("--no-wait", is_flag=True, help="Record without waiting for each commit")
+@click.option("--slow-ms", type=float, default=50.0, show_default=True, help="Slow-query log threshold")
+@click.option("--limit", type=int, default=15, show_default=True, help="Statements to show")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON instead of tables")
+def stats(count, seed, schedule, no_wait, slow_ms, limit, as_json):
+    """Trace every statement of a benchmark run and report per-statement latency"""
+    from sync_bench import parse_schedule, run_benchmark
+
+    try:
+        parse_schedule(schedule)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--schedule")
+    tracer = SQLTracer(slow_ms=slow_ms)
+    run_benchmark(count, seed, schedule=schedule, wait=not no_wait, tracer=tracer)
+    if as_json:
+        click.echo(json.dumps({"statements": tracer.report(), "slow_queries": list(tracer.slow_log)}, indent=2))
+    else:
+        print_report(tracer, console, limit)
+
 if __name__ == "__main__":
     cli()
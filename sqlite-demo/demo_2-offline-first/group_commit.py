@@ -0,0 +1,154 @@
+"""Group commit for small local writes.
+
+A commit in WAL mode costs one fsync of the WAL, whatever the transaction's
+size. GroupCommitWriter puts the writes of many callers in one transaction
+on its own thread and commits them together. It commits once window
+seconds have passed since the first write of the group, or as soon as
+max_batch writes are waiting. Writes that arrive while a commit is in
+progress go into the next group, so under load the group size grows with
+the arrival rate and no caller waits for a full window on its own.
+
+Every write gets a Future that resolves once its transaction has
+committed. A caller that waits on it has the same guarantee as an
+immediate commit: the row is on disk (synchronous=FULL) when it returns.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Sequence
+
+# Put on the queue by close() to stop the writer thread
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, pool, window: float = 0.0, max_batch: int = 256, synchronous: str = "FULL"):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._metrics = {
+            "writes": 0,
+            "errors": 0,
+            "commits": 0,
+            "max_group": 0,
+            "commit_seconds": 0.0,
+        }
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params: Sequence = ()) -> Future:
+        """Queue one statement; the Future resolves (or fails) when its group commits"""
+        future = Future()
+        # checked and queued under the lock, so nothing can land behind close()'s _STOP
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._queue.put((sql, params, future))
+        return future
+
+    def write(self, sql: str, params: Sequence = (), wait: bool = True) -> Future:
+        """submit(), and with wait block until the write is durable, re-raising its error"""
+        future = self.submit(sql, params)
+        if wait:
+            future.result()
+        return future
+
+    def flush(self):
+        """Block until everything submitted so far has been committed"""
+        self.write("SELECT 1")
+
+    def close(self):
+        """Commit what is queued, then stop the writer thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first) -> list:
+        group = [first]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_batch:
+            try:
+                # take whatever is already queued without waiting
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            group.append(item)
+        return group
+
+    def _run(self):
+        conn = self.pool.connection()
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                self._commit(conn, self._collect(item))
+        finally:
+            self.pool.release_thread()
+
+    def _commit(self, conn: sqlite3.Connection, group: list):
+        start = time.perf_counter()
+        done = []
+        errors = 0
+        try:
+            with conn:
+                for sql, params, future in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    in_transaction = conn.in_transaction
+                    try:
+                        conn.execute(sql, params)
+                        done.append(future)
+                    except sqlite3.Error as e:
+                        # a failed statement is usually undone on its own and the rest of the
+                        # group still commits, but errors such as SQLITE_FULL or an I/O error
+                        # roll back the whole transaction, taking the earlier writes with it
+                        future.set_exception(e)
+                        errors += 1
+                        if in_transaction and not conn.in_transaction:
+                            for lost in done:
+                                lost.set_exception(e)
+                            errors += len(done)
+                            done = []
+        except sqlite3.Error as e:
+            for future in done:
+                future.set_exception(e)
+            errors += len(done)
+            done = []
+        elapsed = time.perf_counter() - start
+        for future in done:
+            future.set_result(None)
+        with self._lock:
+            metrics = self._metrics
+            metrics["writes"] += len(group)
+            metrics["errors"] += errors
+            metrics["commits"] += 1
+            metrics["max_group"] = max(metrics["max_group"], len(group))
+            metrics["commit_seconds"] += elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["avg_group"] = stats["writes"] / stats["commits"] if stats["commits"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
@@ -0,0 +1,216 @@
+"""Headless, seeded benchmark of the offline-first sync path.
+
+N transactions are recorded through OfflineFirstDemo.record_transaction
+while a schedule of online/offline periods is replayed. The background
+worker syncs them to LocalServer, an in-process stand-in for the real
+endpoint. The server's decisions (latency, transport errors, rejections)
+depend only on the seed, the transaction's description (which numbers it
+within the run) and its attempt number. So two runs with the same options see the same workload
+and the same failures, and only the sync strategy under test differs.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sync_engine import SyncResult, Transaction, Transport
+
+
+def parse_schedule(text: str) -> List[Tuple[bool, float]]:
+    """"on:5,off:2" -> [(True, 5.0), (False, 2.0)]; the schedule repeats until the run ends"""
+    schedule = []
+    for part in text.split(","):
+        state, _, seconds = part.strip().partition(":")
+        if state not in ("on", "off") or not seconds:
+            raise ValueError(f"bad schedule entry {part!r}, expected on:<seconds> or off:<seconds>")
+        if float(seconds) <= 0:
+            raise ValueError(f"bad schedule entry {part!r}, the period must be positive")
+        schedule.append((state == "on", float(seconds)))
+    if not schedule:
+        raise ValueError("empty schedule")
+    return schedule
+
+
+def percentiles(samples: List[float], points=(50, 90, 95, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles plus mean and max, None when there are no samples"""
+    keys = [f"p{p}" for p in points] + ["mean", "max"]
+    if not samples:
+        return dict.fromkeys(keys)
+    ordered = sorted(samples)
+    result = {f"p{p}": ordered[max(0, -(-p * len(ordered) // 100) - 1)] for p in points}
+    result["mean"] = sum(ordered) / len(ordered)
+    result["max"] = ordered[-1]
+    return result
+
+
+class LocalServer(Transport):
+    """Deterministic stand-in server.
+
+    Unreachable while is_online() is false, so a request in flight when the
+    device drops offline fails the same way a real one would.
+    """
+
+    def __init__(self, seed: int, is_online: Callable[[], bool],
+                 failure_rate: float = 0.2, error_rate: float = 0.0,
+                 min_latency: float = 0.01, max_latency: float = 0.05):
+        self.seed = seed
+        self.is_online = is_online
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.attempts: Dict[str, int] = {}
+        self.requests = 0
+        self.transport_errors = 0
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+    def _rng(self, *key) -> random.Random:
+        return random.Random(":".join(str(part) for part in (self.seed,) + key))
+
+    def send_batch(self, transactions: List[Transaction]) -> Dict[str, bool]:
+        with self._lock:
+            self.requests += 1
+            attempts = {}
+            for t in transactions:
+                attempts[t[0]] = self.attempts[t[0]] = self.attempts.get(t[0], 0) + 1
+        first = transactions[0]
+        rng = self._rng("batch", first[2], attempts[first[0]])
+        time.sleep(rng.uniform(self.min_latency, self.max_latency))
+        if not self.is_online() or rng.random() < self.error_rate:
+            with self._lock:
+                self.transport_errors += 1
+            raise ConnectionError("server unreachable")
+        results = {
+            t[0]: self._rng("tx", t[2], attempts[t[0]]).random() >= self.failure_rate
+            for t in transactions
+        }
+        with self._lock:
+            self.rejections += sum(1 for accepted in results.values() if not accepted)
+        return results
+
+
+def run_benchmark(transactions: int = 1000, seed: int = 42, rate: float = 200.0,
+                  schedule: str = "on:5,off:1", failure_rate: float = 0.2, error_rate: float = 0.0,
+                  min_latency: float = 0.01, max_latency: float = 0.05, batch_size: int = 50,
+                  concurrency: int = 4, coalesce_window: float = 0.05, timeout: float = 120.0,
+                  wait: bool = True, tracer=None) -> dict:
+    """Run one benchmark on a scratch database and return the report as a dict.
+
+    rate is the mean number of transactions recorded per second (Poisson
+    arrivals); 0 records them all at once. wait is passed on to
+    record_transaction. A sql_trace.SQLTracer given as tracer records every
+    statement of the run.
+    """
+    # imported here because demo.py imports this module for its bench command
+    from demo import OfflineFirstDemo, console
+
+    periods = parse_schedule(schedule)
+    rng = random.Random(seed)
+    arrivals, clock = [], 0.0
+    for _ in range(transactions):
+        if rate > 0:
+            clock += rng.expovariate(rate)
+        arrivals.append((clock, round(rng.uniform(1, 500), 2), f"bench transaction {len(arrivals)}"))
+
+    workdir = tempfile.mkdtemp(prefix="sync-bench-")
+    enqueued_at: Dict[str, float] = {}
+    synced_at: Dict[str, float] = {}
+    online = {"value": periods[0][0]}
+    server = LocalServer(seed, lambda: online["value"], failure_rate, error_rate,
+                         min_latency, max_latency)
+    passes: List[SyncResult] = []
+    seen = 0
+
+    def on_batch(result: SyncResult):
+        # result is cumulative for the pass, so only its new ids are stamped
+        nonlocal seen
+        now = time.perf_counter()
+        if not passes or result is not passes[-1]:
+            passes.append(result)
+            seen = 0
+        for transaction_id in result.synced_ids[seen:]:
+            synced_at[transaction_id] = now
+        seen = len(result.synced_ids)
+
+    quiet = console.quiet
+    console.quiet = True
+    demo = OfflineFirstDemo(os.path.join(workdir, "edge.db"), transport=server, batch_size=batch_size,
+                            concurrency=concurrency, coalesce_window=coalesce_window, tracer=tracer)
+    try:
+        demo.on_sync_batch = on_batch
+        demo.is_online = online["value"]
+        demo.start_sync_worker()
+
+        start = time.perf_counter()
+        deadline = start + timeout
+        period, period_end = 0, start + periods[0][1]
+        index = 0
+        drained = flushed = False
+        while True:
+            now = time.perf_counter()
+            if now >= period_end:
+                period = (period + 1) % len(periods)
+                period_end += periods[period][1]
+                if periods[period][0] != demo.is_online:
+                    online["value"] = periods[period][0]
+                    demo.toggle_connection()
+                continue
+            while index < len(arrivals) and start + arrivals[index][0] <= now:
+                _, amount, description = arrivals[index]
+                enqueue = time.perf_counter()
+                transaction_id = demo.record_transaction(amount, description, wait)
+                if transaction_id is not None:
+                    enqueued_at[transaction_id] = enqueue
+                index += 1
+            if index == len(arrivals) and not flushed:
+                # without wait the last inserts may not have committed yet
+                demo.writer.flush()
+                flushed = True
+            if flushed and demo.sync_counts()["pending"] == 0:
+                drained = True
+                break
+            if now >= deadline:
+                break
+            wake = period_end
+            if index < len(arrivals):
+                wake = min(wake, start + arrivals[index][0])
+            time.sleep(min(max(0.0, wake - time.perf_counter()), 0.01))
+        elapsed = time.perf_counter() - start
+        demo.stop_sync_worker()
+        counts = demo.sync_counts()
+    finally:
+        console.quiet = quiet
+        demo.writer.close()
+        demo.pool.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [synced_at[t] - enqueued_at[t] for t in synced_at if t in enqueued_at]
+    first, last = min(enqueued_at.values(), default=0.0), max(synced_at.values(), default=0.0)
+    attempts = list(server.attempts.values())
+    return {
+        "config": {
+            "transactions": transactions, "seed": seed, "rate": rate, "schedule": schedule,
+            "failure_rate": failure_rate, "error_rate": error_rate,
+            "min_latency": min_latency, "max_latency": max_latency, "batch_size": batch_size,
+            "concurrency": concurrency, "coalesce_window": coalesce_window, "wait": wait,
+        },
+        "drained": drained,
+        "elapsed_seconds": elapsed,
+        "recorded": len(enqueued_at),
+        "synced": counts["synced"],
+        "failed": counts["failed"],
+        "pending": counts["pending"],
+        "latency_seconds": percentiles(latencies),
+        "throughput_tps": len(latencies) / (last - first) if last > first else None,
+        "sync_passes": len(passes),
+        "requests": server.requests,
+        "transport_errors": server.transport_errors,
+        "rejections": server.rejections,
+        "retries": sum(attempts) - len(attempts),
+        "max_attempts": max(attempts, default=0),
+    }
@@ -0,0 +1,205 @@
+"""Batched, concurrent push of pending transactions to the server.
+
+Pending transactions are sent in batches of batch_size, with up to
+concurrency batches in flight at once. The SQLite connection stays on the
+calling thread: each batch's results are written back there with one
+executemany per statement inside a single transaction.
+"""
+
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+# (id, amount, description) as selected from the transactions table
+Transaction = Tuple[str, float, str]
+
+
+class Transport:
+    """Delivers a batch of transactions to the server"""
+
+    def send_batch(self, transactions: List[Transaction]) -> Dict[str, bool]:
+        """Return {transaction id: accepted}; raise if the batch as a whole failed"""
+        raise NotImplementedError
+
+
+class SimulatedTransport(Transport):
+    """Stand-in server with random latency per request and random per-transaction failures"""
+
+    def __init__(self, min_latency: float = 0.1, max_latency: float = 0.5,
+                 failure_rate: float = 0.2, rng: Optional[random.Random] = None):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def send_batch(self, transactions: List[Transaction]) -> Dict[str, bool]:
+        with self._lock:
+            latency = self.rng.uniform(self.min_latency, self.max_latency)
+            results = {t[0]: self.rng.random() >= self.failure_rate for t in transactions}
+        # Simulate network latency, paid once per request
+        time.sleep(latency)
+        return results
+
+
+class HttpTransport(Transport):
+    """POSTs {"transactions": [...]} to url and expects {"results": {id: bool}} back"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send_batch(self, transactions: List[Transaction]) -> Dict[str, bool]:
+        payload = {"transactions": [
+            {"id": t[0], "amount": t[1], "description": t[2]} for t in transactions
+        ]}
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json().get("results", {})
+        return {t[0]: bool(results.get(t[0], False)) for t in transactions}
+
+
+class Backoff:
+    """Exponential backoff with jitter: attempt n waits between d/2 and d, d = min(cap, base * 2**n)"""
+
+    def __init__(self, base: float = 0.5, cap: float = 30.0, rng: Optional[random.Random] = None):
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = self.delay(self.attempt)
+        self.attempt += 1
+        return delay
+
+    def delay(self, attempt: int) -> float:
+        """Jittered delay for attempt n, without changing this backoff's own count"""
+        delay = min(self.cap, self.base * (2 ** attempt))
+        return delay / 2 + self.rng.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+
+@dataclass
+class SyncResult:
+    pending: int = 0
+    synced: int = 0
+    failed: int = 0
+    errors: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    synced_ids: List[str] = field(default_factory=list)
+
+
+class SyncEngine:
+    """Sends pending transactions and writes the outcome back.
+
+    A rejected transaction is retried at most max_retries times. Each
+    rejection schedules its next attempt in the row's next_retry_at (epoch
+    seconds) with the jittered exponential delays of retry_backoff (1-2 s,
+    then 2-4 s, ... by default), and
+    passes leave the row out until then. New traffic therefore does not
+    retry a rejected row early.
+    """
+
+    def __init__(self, transport: Transport, batch_size: int = 50, concurrency: int = 4,
+                 max_retries: int = 3, retry_backoff: Optional[Backoff] = None):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # a rejection is an answer from the server, so it waits longer than a transport error
+        self.retry_backoff = retry_backoff or Backoff(base=2.0, cap=60.0)
+        # one pass at a time, so two callers never send the same rows
+        self._lock = threading.Lock()
+
+    def fetch_pending(self, conn: sqlite3.Connection) -> List[Transaction]:
+        return conn.execute("""
+        SELECT id, amount, description
+        FROM transactions
+        WHERE synced = 0 AND retry_count < ?
+          AND (next_retry_at IS NULL OR next_retry_at <= ?)
+        ORDER BY timestamp
+        """, (self.max_retries, time.time())).fetchall()
+
+    def next_retry_delay(self, conn: sqlite3.Connection) -> Optional[float]:
+        """Seconds until the earliest rejected transaction is due again, None if none is waiting"""
+        due, = conn.execute("""
+        SELECT MIN(next_retry_at)
+        FROM transactions
+        WHERE synced = 0 AND retry_count < ? AND next_retry_at IS NOT NULL
+        """, (self.max_retries,)).fetchone()
+        return None if due is None else max(0.0, due - time.time())
+
+    def sync_pending(self, conn: sqlite3.Connection,
+                     on_batch: Optional[Callable[[SyncResult], None]] = None) -> SyncResult:
+        """Send every pending transaction and record the outcome.
+
+        on_batch, if given, is called on this thread with the partial result
+        after each batch has been written back.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            pending = self.fetch_pending(conn)
+            result = SyncResult(pending=len(pending))
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            if batches:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as executor:
+                    futures = {executor.submit(self.transport.send_batch, batch): batch for batch in batches}
+                    for future in as_completed(futures):
+                        batch = futures[future]
+                        try:
+                            accepted = future.result()
+                            error = None
+                        except Exception as e:
+                            accepted, error = {}, e
+                        self._write_back(conn, batch, accepted, error, result)
+                        if on_batch:
+                            on_batch(result)
+            result.seconds = time.perf_counter() - start
+            return result
+
+    def _write_back(self, conn: sqlite3.Connection, batch: List[Transaction],
+                    accepted: Dict[str, bool], error: Optional[Exception], result: SyncResult):
+        if error is not None:
+            synced, failed = [], []
+            log = [("sync_error", f"Error syncing {t[0]}: {error}") for t in batch]
+        else:
+            synced = [(t[0],) for t in batch if accepted.get(t[0])]
+            # the delay grows with the row's retry_count: base * 2**n, capped, times a jitter in [0.5, 1]
+            now = time.time()
+            backoff = self.retry_backoff
+            failed = [(now, backoff.cap, backoff.base, backoff.rng.uniform(0.5, 1.0), t[0])
+                      for t in batch if not accepted.get(t[0])]
+            log = [("sync_success", f"Transaction {t} synced successfully") for t, in synced]
+            log += [("sync_failure", f"Failed to sync transaction {t[-1]}") for t in failed]
+        with conn:
+            conn.executemany("""
+            UPDATE transactions
+            SET synced = 1, sync_timestamp = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """, synced)
+            conn.executemany("""
+            UPDATE transactions
+            SET retry_count = retry_count + 1,
+                next_retry_at = ? + MIN(?, ? * (1 << retry_count)) * ?
+            WHERE id = ?
+            """, failed)
+            conn.executemany("""
+            INSERT INTO sync_log (event_type, details)
+            VALUES (?, ?)
+            """, log)
+        result.batches += 1
+        result.synced += len(synced)
+        result.failed += len(failed)
+        result.errors += len(batch) if error is not None else 0
+        result.synced_ids.extend(t for t, in synced)
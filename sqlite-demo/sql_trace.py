@@ -0,0 +1,483 @@
+"""Statement tracing for the demos' SQLite connections.
+
+SQLTracer.factory is a sqlite3.Connection subclass: pass it to
+sqlite3.connect(factory=...) or to ConnectionPool(factory=...). Every
+statement run through such a connection is timed from execute until its
+rows have been read, and recorded under its normalized SQL (literals and
+IN lists replaced by ?, whitespace collapsed). Per statement the tracer keeps
+the call count, errors, latency percentiles, rows returned or changed, and
+the time spent waiting for a lock. Statements slower than slow_ms also go to
+a slow-query log.
+
+SQLite's busy handler sleeps inside the library, where the wait cannot be
+timed. Traced connections therefore set busy_timeout to 0 and retry a locked
+statement themselves, with the same timeout and an exponential sleep. A
+statement is only retried when SQLite would have waited too: when it started
+outside a transaction (any partial implicit transaction is rolled back
+first), or when it is a single statement in a transaction that has not
+touched the database yet. Once a transaction has read, a BUSY error is a
+conflict that waiting cannot resolve, and SQLITE_BUSY_SNAPSHOT never is
+retried. executescript() and executemany() over an iterator cannot be
+repeated, so they keep SQLite's own busy handling and report no lock wait.
+
+python sql_trace.py checks this behaviour under lock contention against
+plain connections and exits with status 1 on a difference.
+"""
+
+import logging
+import math
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger("sql_trace")
+logger.addHandler(logging.NullHandler())
+
+_COMMENT = re.compile(r"--[^\n]*")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w?:@$])\d+(?:\.\d+)?\b")  # not ?1 or :name2
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+_BEGIN = re.compile(r"^\s*BEGIN\b", re.IGNORECASE)
+_BUSY_TIMEOUT = re.compile(r"^\s*PRAGMA\s+busy_timeout\s*=\s*(\d+)\s*;?\s*$", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql: str) -> str:
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?, ...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        # the snapshot of a WAL read transaction is stale, waiting cannot help
+        if code == sqlite3.SQLITE_BUSY_SNAPSHOT:
+            return False
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error)
+
+
+class _StatementStats:
+    __slots__ = ("count", "errors", "seconds", "max_seconds", "rows", "lock_waits",
+                 "lock_wait_seconds", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.samples = []
+
+
+class SQLTracer:
+    def __init__(self, slow_ms: float = 100.0, slow_log_size: int = 100, sample_size: int = 1024):
+        self.slow_ms = slow_ms
+        self.sample_size = sample_size
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._stats = {}
+        self._lock = threading.Lock()
+        # reservoir sampling keeps the percentiles unbiased past sample_size calls
+        self._rng = random.Random(0)
+        self.factory = type("TracedConnection", (TracedConnection,), {"tracer": self})
+
+    def record(self, sql: str, seconds: float, rows: int, lock_wait: float, error: bool = False):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats()
+            stats.count += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += max(0, rows)
+            if lock_wait:
+                stats.lock_waits += 1
+                stats.lock_wait_seconds += lock_wait
+            if len(stats.samples) < self.sample_size:
+                stats.samples.append(seconds)
+            else:
+                slot = self._rng.randrange(stats.count)
+                if slot < self.sample_size:
+                    stats.samples[slot] = seconds
+        if seconds * 1000.0 >= self.slow_ms:
+            entry = {"time": time.time(), "sql": key, "seconds": seconds, "rows": max(0, rows),
+                     "lock_wait_seconds": lock_wait, "error": error}
+            self.slow_log.append(entry)
+            logger.warning("slow query %.1f ms (%.1f ms waiting for a lock): %s",
+                           seconds * 1000.0, lock_wait * 1000.0, key)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_log.clear()
+
+    def report(self) -> list:
+        """One dict per normalized statement, highest total time first"""
+        with self._lock:
+            items = [(key, stats, sorted(stats.samples)) for key, stats in self._stats.items()]
+        result = []
+        for key, stats, samples in items:
+            def percentile(p):
+                # nearest rank
+                return samples[max(0, math.ceil(p / 100.0 * len(samples)) - 1)] if samples else 0.0
+            result.append({
+                "sql": key,
+                "count": stats.count,
+                "errors": stats.errors,
+                "total_seconds": stats.seconds,
+                "mean_seconds": stats.seconds / stats.count,
+                "p50_seconds": percentile(50),
+                "p95_seconds": percentile(95),
+                "p99_seconds": percentile(99),
+                "max_seconds": stats.max_seconds,
+                "rows": stats.rows,
+                "lock_waits": stats.lock_waits,
+                "lock_wait_seconds": stats.lock_wait_seconds,
+            })
+        result.sort(key=lambda entry: entry["total_seconds"], reverse=True)
+        return result
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor recording each statement once it has been read to the end or replaced"""
+
+    _pending = None  # [sql, start, rows, lock_wait] of the statement still being read
+
+    def _finish(self, error: bool = False):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            sql, start, rows, lock_wait = pending
+            self.connection.tracer.record(sql, time.perf_counter() - start, rows, lock_wait, error)
+
+    def _run(self, method, sql, parameters, many: bool):
+        self._finish()
+        conn = self.connection
+        match = _BUSY_TIMEOUT.match(sql) if not many else None
+        if match:
+            # the connection does its own busy waiting, see the module docstring
+            conn.lock_timeout = int(match.group(1)) / 1000.0
+            parameters = ()
+            sql_to_run = "PRAGMA busy_timeout = 0"
+        else:
+            sql_to_run = sql
+        start = time.perf_counter()
+        pending = self._pending = [sql, start, 0, 0.0]
+        in_transaction = conn.in_transaction
+        if not in_transaction:
+            conn.transaction_started = False
+        # a failed attempt may have consumed part of an iterator, so it is never repeated
+        native = many and not isinstance(parameters, (list, tuple))
+        # inside a transaction only a statement that comes before any read or write is retried
+        retry = not native and (not in_transaction or not (many or conn.transaction_started))
+        delay = 0.001
+        while True:
+            try:
+                if native:
+                    self._run_waiting(lambda: method(self, sql_to_run, parameters))
+                else:
+                    method(self, sql_to_run, parameters)
+                break
+            except sqlite3.OperationalError as e:
+                elapsed = time.perf_counter() - start
+                if not retry or not _is_busy(e) or elapsed >= conn.lock_timeout:
+                    self._finish(error=True)
+                    raise
+                if not in_transaction and conn.in_transaction:
+                    # undo what this call began so the retry starts clean
+                    sqlite3.Connection.rollback(conn)
+                pause = min(delay, conn.lock_timeout - elapsed)
+                time.sleep(pause)
+                pending[3] += pause
+                delay = min(delay * 2, 0.05)
+            except Exception:
+                self._finish(error=True)
+                raise
+        if conn.in_transaction and not _BEGIN.match(sql):
+            conn.transaction_started = True
+        if self.description is None:
+            pending[2] = self.rowcount
+            self._finish()
+        return self
+
+    def _run_waiting(self, call):
+        """call() with SQLite's own busy handler restored while it runs"""
+        conn = self.connection
+        # through the base class, so the PRAGMAs neither reset this cursor nor get traced
+        sqlite3.Connection.execute(conn, f"PRAGMA busy_timeout = {int(conn.lock_timeout * 1000)}")
+        try:
+            call()
+        finally:
+            sqlite3.Connection.execute(conn, "PRAGMA busy_timeout = 0")
+
+    def execute(self, sql, parameters=()):
+        return self._run(sqlite3.Cursor.execute, sql, parameters, many=False)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(sqlite3.Cursor.executemany, sql, seq_of_parameters, many=True)
+
+    def executescript(self, sql_script):
+        self._finish()
+        conn = self.connection
+        start = time.perf_counter()
+        try:
+            self._run_waiting(lambda: sqlite3.Cursor.executescript(self, sql_script))
+        except Exception:
+            conn.tracer.record(sql_script, time.perf_counter() - start, 0, 0.0, True)
+            raise
+        conn.tracer.record(sql_script, time.perf_counter() - start, 0, 0.0)
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        if self._pending is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._pending[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        if self._pending is not None:
+            self._pending[2] += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self._pending is not None:
+            self._pending[2] += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        if self._pending is not None:
+            self._pending[2] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors and shortcut methods all go through TracedCursor"""
+
+    tracer = None  # set on the subclass SQLTracer.factory creates
+
+    def __init__(self, *args, **kwargs):
+        # keep the requested busy timeout for the Python-level retry loop
+        self.lock_timeout = kwargs.pop("timeout", 5.0)
+        kwargs["timeout"] = 0
+        super().__init__(*args, **kwargs)
+        # set once the open transaction has run a statement, see TracedCursor._run
+        self.transaction_started = False
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TracedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        start = time.perf_counter()
+        lock_wait = 0.0
+        delay = 0.001
+        while True:
+            try:
+                super().commit()
+                break
+            except sqlite3.OperationalError as e:
+                elapsed = time.perf_counter() - start
+                if not _is_busy(e) or elapsed >= self.lock_timeout:
+                    self.tracer.record("COMMIT", elapsed, 0, lock_wait, True)
+                    raise
+                pause = min(delay, self.lock_timeout - elapsed)
+                time.sleep(pause)
+                lock_wait += pause
+                delay = min(delay * 2, 0.05)
+        self.tracer.record("COMMIT", time.perf_counter() - start, 0, lock_wait)
+
+    def __exit__(self, exc_type, exc, tb):
+        # the C implementation would bypass the retrying commit() above
+        if exc_type is None:
+            try:
+                self.commit()
+            except Exception:
+                self.rollback()
+                raise
+        else:
+            self.rollback()
+        return False
+
+
+def _shorten(sql: str, length: int = 120) -> str:
+    # scripts would otherwise fill the table; report() keeps the full text
+    return sql if len(sql) <= length else sql[:length - 1] + "\u2026"
+
+
+def print_report(tracer: SQLTracer, console, limit: int = 15):
+    """Render the report and the slow-query log as rich tables on console"""
+    from rich.table import Table
+
+    table = Table(title="SQL Statements (by total time)")
+    # only the statement column wraps on a narrow terminal
+    table.add_column("Statement", style="cyan", overflow="fold", max_width=60)
+    table.add_column("Calls", justify="right", no_wrap=True)
+    table.add_column("Total ms", justify="right", style="green", no_wrap=True)
+    table.add_column("p50/p95/p99 ms", justify="right", no_wrap=True)
+    table.add_column("Rows", justify="right", no_wrap=True)
+    table.add_column("Lock wait ms", justify="right", style="yellow", no_wrap=True)
+    table.add_column("Err", justify="right", style="red", no_wrap=True)
+    for entry in tracer.report()[:limit]:
+        table.add_row(
+            _shorten(entry["sql"]),
+            str(entry["count"]),
+            f"{entry['total_seconds'] * 1000:.2f}",
+            f"{entry['p50_seconds'] * 1000:.2f}/{entry['p95_seconds'] * 1000:.2f}/"
+            f"{entry['p99_seconds'] * 1000:.2f}",
+            str(entry["rows"]),
+            f"{entry['lock_wait_seconds'] * 1000:.1f}",
+            str(entry["errors"]),
+        )
+    console.print(table)
+
+    if tracer.slow_log:
+        table = Table(title=f"Slow Queries (>= {tracer.slow_ms:g} ms)")
+        table.add_column("Time", style="cyan", no_wrap=True)
+        table.add_column("ms", justify="right", style="red", no_wrap=True)
+        table.add_column("Lock wait ms", justify="right", style="yellow", no_wrap=True)
+        table.add_column("Statement", overflow="fold", max_width=70)
+        for entry in tracer.slow_log:
+            table.add_row(time.strftime("%H:%M:%S", time.localtime(entry["time"])),
+                          f"{entry['seconds'] * 1000:.1f}", f"{entry['lock_wait_seconds'] * 1000:.1f}",
+                          _shorten(entry["sql"]))
+        console.print(table)
+
+
+def _hold_write_lock(path: str, seconds: float) -> threading.Thread:
+    """Hold the write lock of path from another connection for seconds, returning once it is held"""
+    held = threading.Event()
+
+    def hold():
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        held.set()
+        time.sleep(seconds)
+        conn.execute("COMMIT")
+        conn.close()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    return thread
+
+
+def main():
+    """Run the same writes on a plain and a traced connection while another one holds the lock"""
+    import os
+    import shutil
+    import sys
+    import tempfile
+
+    def rows_gen():
+        return ((i,) for i in range(5))
+
+    cases = [
+        ("execute", lambda conn: conn.execute("INSERT INTO t VALUES (1)")),
+        ("executemany over a list", lambda conn: conn.executemany("INSERT INTO t VALUES (?)", list(rows_gen()))),
+        ("executemany over a generator", lambda conn: conn.executemany("INSERT INTO t VALUES (?)", rows_gen())),
+        ("executescript", lambda conn: conn.executescript("BEGIN; INSERT INTO t VALUES (1); COMMIT;")),
+    ]
+    workdir = tempfile.mkdtemp(prefix="sql-trace-")
+    failures = 0
+    try:
+        path = os.path.join(workdir, "check.db")
+        setup = sqlite3.connect(path)
+        setup.execute("PRAGMA journal_mode = WAL")
+        setup.execute("CREATE TABLE t (x)")
+        setup.close()
+        for name, write in cases:
+            results = []
+            for factory in (sqlite3.Connection, SQLTracer().factory):
+                conn = sqlite3.connect(path, timeout=2.0, factory=factory)
+                sqlite3.Connection.execute(conn, "DELETE FROM t")
+                conn.commit()
+                holder = _hold_write_lock(path, 0.2)
+                try:
+                    write(conn)
+                    conn.commit()
+                    outcome = "ok"
+                except sqlite3.Error as e:
+                    outcome = type(e).__name__
+                holder.join()
+                count = sqlite3.Connection.execute(conn, "SELECT COUNT(*) FROM t").fetchone()[0]
+                conn.close()
+                results.append((outcome, count))
+            same = results[0] == results[1]
+            failures += not same
+            print("%-30s plain %-20s traced %-20s %s" % (name, results[0], results[1], "ok" if same else "DIFFERENT"))
+
+        # a stale WAL snapshot fails at once on both connections
+        results = []
+        for factory in (sqlite3.Connection, SQLTracer().factory):
+            conn = sqlite3.connect(path, timeout=2.0, factory=factory, isolation_level=None)
+            other = sqlite3.connect(path, isolation_level=None)
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM t").fetchall()
+            other.execute("INSERT INTO t VALUES (2)")
+            start = time.perf_counter()
+            try:
+                conn.execute("INSERT INTO t VALUES (3)")
+                outcome = "ok"
+            except sqlite3.OperationalError as e:
+                outcome = getattr(e, "sqlite_errorcode", None)
+            conn.execute("ROLLBACK")
+            results.append((outcome, time.perf_counter() - start < 0.5))
+            conn.close()
+            other.close()
+        same = results[0] == results[1]
+        failures += not same
+        print("%-30s plain %-20s traced %-20s %s" % ("stale snapshot", results[0], results[1],
+                                                      "ok" if same else "DIFFERENT"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Small SQLite connection pool shared by the demos.
+
+Each thread gets its own connection, opened in WAL mode with a busy
+timeout. Readers and the writer then no longer block each other, and a
+briefly held write lock makes other writers wait instead of failing with
+"database is locked". Python's per-connection statement cache is enlarged
+so the demos' repeated statements are prepared once per connection.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the checkout timeout"""
+
+
+class ConnectionPool:
+    def __init__(self, db_name: str, max_connections: int = 8, busy_timeout_ms: int = 5000,
+                 wal: bool = True, statement_cache_size: int = 256,
+                 checkout_timeout: Optional[float] = None, factory: type = sqlite3.Connection):
+        self.db_name = db_name
+        self.max_connections = max_connections
+        self.busy_timeout_ms = busy_timeout_ms
+        self.wal = wal
+        self.statement_cache_size = statement_cache_size
+        self.checkout_timeout = checkout_timeout
+        # Connection class to open, e.g. sql_trace.SQLTracer().factory
+        self.factory = factory
+        self._idle = []
+        self._all = []
+        self._in_use = 0
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._metrics = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "peak_in_use": 0,
+        }
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000.0,
+            cached_statements=self.statement_cache_size,
+            # a pooled connection is only used by one thread at a time,
+            # but not always the thread that opened it
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if self.wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, waiting while all are in use"""
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and len(self._all) >= self.max_connections:
+                waited = True
+                remaining = None
+                if self.checkout_timeout is not None:
+                    remaining = self.checkout_timeout - (time.perf_counter() - start)
+                    if remaining <= 0:
+                        raise PoolTimeout(f"no free connection to {self.db_name} after {self.checkout_timeout}s")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = None
+                self._all.append(None)  # reserve the slot while opening
+            self._in_use += 1
+            elapsed = time.perf_counter() - start
+            metrics = self._metrics
+            metrics["checkouts"] += 1
+            if waited:
+                metrics["waits"] += 1
+                metrics["wait_seconds"] += elapsed
+                metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], elapsed)
+            metrics["peak_in_use"] = max(metrics["peak_in_use"], self._in_use)
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._all.remove(None)
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._all[self._all.index(None)] = conn
+                self._metrics["created"] += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Give a connection back; an open transaction is rolled back"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self):
+        """with pool.checkout() as conn: ... borrows a connection for the block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's own connection, held until release_thread()"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.acquire()
+        return conn
+
+    def release_thread(self):
+        """Return the calling thread's connection to the pool"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            self.release(conn)
+
+    def close_all(self):
+        """Close every connection, including ones still handed out"""
+        with self._cond:
+            for conn in self._all:
+                if conn is not None:
+                    conn.close()
+            self._all = []
+            self._idle = []
+            self._in_use = 0
+            self._cond.notify_all()
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._metrics)
+            stats["open"] = sum(1 for conn in self._all if conn is not None)
+            stats["in_use"] = self._in_use
+            stats["idle"] = len(self._idle)
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / stats["waits"] if stats["waits"] else 0.0
+        return stats